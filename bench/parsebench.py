@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""Benchmark and regression check for wikicurses.htmlparse.
+
+The parsers are run over the pages in bench/corpus, which are saved outputs
+of action=parse (*.json.gz) and action=featuredfeed (*.xml.gz). For every
+page and parser the time, the peak of memory allocated by Python, the peak
+growth of the resident set size of a process running the parser alone, which
+also counts memory allocated by libxml2, and the size of the output are
+reported. The output is compared to the golden files in
+bench/golden, and the timings to a baseline saved with --save-baseline.
+The exit status is 1 if any output differs or is slower than the baseline.
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+import resource
+import tracemalloc
+import multiprocessing
+
+benchdir = os.path.dirname(os.path.abspath(__file__))
+corpusdir = os.path.join(benchdir, 'corpus')
+goldendir = os.path.join(benchdir, 'golden')
+baselinepath = os.path.join(benchdir, 'baseline.json')
+
+sys.path.insert(0, os.path.dirname(benchdir))
+
+from wikicurses import settings
+from wikicurses.htmlparse import (parseArticle, parseDisambig, parseFeature,
+                                  parseFeed)
+
+
+def _article(html, parser):
+    settings.parser = parser
+    # The golden files hold the content as a list of [format, text] pairs
+    return [list(i) for i in parseArticle(html)]
+
+
+def _disambig(html):
+    return [[name, items] for name, items in parseDisambig(html).items()]
+
+
+def _feature(descriptions):
+    return [parseFeature(i) for i in descriptions]
+
+
+def _loadpage(name):
+    """Return list of (parser name, function, argument) for a corpus page."""
+    path = os.path.join(corpusdir, name)
+    if name.endswith('.xml.gz'):
+        with gzip.open(path) as file:
+            feed = parseFeed(file.read())
+        descriptions = [feed['description']]
+        descriptions += [description for title, description in feed['items']]
+        return [('feature', _feature, (descriptions,))]
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        result = json.load(file)['parse']
+    html = result['text']['*']
+    cases = [('article-lxml', _article, (html, 'lxml')),
+             ('article-bs4', _article, (html, 'bs4'))]
+    if any(i['name'] == 'disambiguation'
+           for i in result.get('properties', ())):
+        cases.append(('disambig', _disambig, (html,)))
+    return cases
+
+
+def _rss(page, parser):
+    """Return the growth of the peak RSS in KiB of running parser on page.
+
+    Run in a new process, so the peak is of this run only.
+    """
+    func, args = next((func, args) for name, func, args in _loadpage(page)
+                      if name == parser)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    func(*args)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In bytes on macOS
+    return (after - before) // (1024 if sys.platform == 'darwin' else 1)
+
+
+def _golden(page, parser):
+    # Both article backends must produce the same output
+    kind = parser.split('-')[0]
+    return os.path.join(goldendir,
+                        page.split('.')[0] + '.' + kind + '.json.gz')
+
+
+def _size(output):
+    return sum(len(i) if isinstance(i, str) else _size(i)
+               for i in output if not isinstance(i, int))
+
+
+def run(pages, repeat, tolerance, savebaseline, updategolden):
+    baseline = {}
+    if os.path.exists(baselinepath) and not savebaseline:
+        with open(baselinepath) as file:
+            baseline = json.load(file)
+    results = {}
+    failed = False
+
+    print('%-22s %-13s %10s %10s %10s %10s  %s' %
+          ('page', 'parser', 'time (ms)', 'heap (KiB)', 'rss (KiB)', 'size',
+           'status'))
+    # Processes inherit the peak RSS of their parent, even across exec, so
+    # they are forked from a server started before anything is parsed
+    context = multiprocessing.get_context('forkserver')
+    pool = context.Pool(1, maxtasksperchild=1)
+    for page in pages:
+        for parser, func, args in _loadpage(page):
+            times = []
+            for i in range(repeat):
+                start = time.perf_counter()
+                output = func(*args)
+                times.append(time.perf_counter() - start)
+            tracemalloc.start()
+            func(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rss = pool.apply(_rss, (page, parser))
+            # Round trip through json, so it compares equal to golden files
+            output = json.loads(json.dumps(output))
+
+            status = []
+            golden = _golden(page, parser)
+            if updategolden:
+                os.makedirs(goldendir, exist_ok=True)
+                with gzip.open(golden, 'wt', encoding='utf-8') as file:
+                    json.dump(output, file, indent=0, ensure_ascii=False)
+                status.append('golden updated')
+            elif not os.path.exists(golden):
+                status.append('no golden file')
+            else:
+                with gzip.open(golden, 'rt', encoding='utf-8') as file:
+                    if json.load(file) != output:
+                        status.append('OUTPUT DIFFERS')
+                        failed = True
+
+            key = page + ':' + parser
+            best = min(times)
+            results[key] = {'time': best, 'peak': peak, 'rss': rss,
+                            'size': _size(output)}
+            if key in baseline:
+                previous = baseline[key]['time']
+                change = (best - previous) / previous * 100
+                status.append('%+.0f%%' % change)
+                # Ignore differences below a millisecond, which are noise
+                if best > previous * (1 + tolerance) + .001:
+                    status.append('SLOWER')
+                    failed = True
+            print('%-22s %-13s %10.1f %10d %10d %10d  %s' %
+                  (page, parser, best * 1000, peak // 1024, rss,
+                   results[key]['size'], ' '.join(status)))
+
+    pool.close()
+    pool.join()
+
+    if savebaseline:
+        with open(baselinepath, 'w') as file:
+            json.dump(results, file, indent=1, sort_keys=True)
+        print("Baseline written to " + baselinepath + '.')
+    return failed
+
+
+def record(name, title, wikiname, feed):
+    """Save a page or featured feed from a wiki to the corpus."""
+    from wikicurses.wiki import Wiki
+    if not wikiname:
+        wikiname = settings.conf['general']['default']
+    if wikiname in settings.conf:
+        wiki = Wiki.fromName(wikiname)
+    else:
+        wiki = Wiki.fromApiUrl(wikiname)
+    if feed:
+        path = os.path.join(corpusdir, name + '.xml.gz')
+        data = wiki._query(action="featuredfeed", feed=title)
+    else:
+        path = os.path.join(corpusdir, name + '.json.gz')
+        data = wiki._query(action="parse", page=title,
+                           prop="externallinks|iwlinks|langlinks|"
+                           "links|displaytitle|properties|text",
+                           format="json", redirects=True)
+    with gzip.open(path, 'wt', encoding='utf-8') as file:
+        file.write(data)
+    print("Saved " + path + '.')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the wikicurses parsers on the saved corpus.")
+    parser.add_argument('pages', nargs='*',
+                        help="corpus files to run (default: all)")
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help="runs per page; the fastest is reported")
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+                        help="allowed slowdown compared to the baseline")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="save the timings as the new baseline")
+    parser.add_argument('--update-golden', action='store_true',
+                        help="overwrite the golden files with the output")
+    parser.add_argument('--record', nargs=2, metavar=('NAME', 'TITLE'),
+                        help="save a page from the wiki to the corpus")
+    parser.add_argument('--feed', action='store_true',
+                        help="with --record, TITLE is a featured feed")
+    parser.add_argument('-w', '--wiki', help='wiki name or api url')
+    args = parser.parse_args()
+
+    if settings.hide_references:
+        sys.exit("Error: the golden files assume hide_references is disabled")
+    if args.record:
+        record(args.record[0], args.record[1], args.wiki, args.feed)
+        return
+    pages = args.pages or sorted(os.listdir(corpusdir))
+    if run(pages, args.repeat, args.tolerance, args.save_baseline,
+           args.update_golden):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
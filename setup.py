@@ -16,7 +16,9 @@ setup(name='Wikicurses',
           ('/usr/share/man/man5', ['wikicurses.conf.5']),
           ('/usr/share/zsh/site-functions', ['_wikicurses'])
           ],
-      entry_points={'console_scripts': ['wikicurses = wikicurses.main:main']},
+      entry_points={'console_scripts': [
+          'wikicurses = wikicurses.main:main',
+          'wikicurses-complete = wikicurses.complete:main']},
       install_requires = ['beautifulsoup4', 'lxml', 'urwid'],
       classifiers=[
           "Topic :: Internet :: WWW/HTTP",
@@ -0,0 +1,283 @@
+"""Backends answering the api.php queries made by Wiki.
+
+HttpBackend sends them to a MediaWiki server. DumpBackend answers the
+queries used for reading from a local MediaWiki XML dump, either
+uncompressed or a bzip2 multistream dump with its index, so articles are
+shown by the same code as articles from a server.
+"""
+import os
+import re
+import bz2
+import json
+import mmap
+import random
+import sqlite3
+import threading
+import urllib.parse
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+
+from wikicurses.wikitext import toHtml
+from wikicurses.settings import wikiconfigpath
+
+
+def openBackend(url, pool):
+    """Return the backend for a wiki api url or path of a dump."""
+    path = url[len('file://'):] if url.startswith('file://') else url
+    if '://' not in path and os.path.exists(path):
+        return DumpBackend(os.path.abspath(path),
+                           wikiconfigpath(url) + '/dumpindex.sqlite')
+    return HttpBackend(url, pool)
+
+
+class HttpBackend:
+    """Sends queries to the api.php of a wiki."""
+    readonly = False
+
+    def __init__(self, url, pool):
+        self.url = url
+        self.pool = pool
+
+    def query(self, params, post=False):
+        """Make a query and return the response as a string."""
+        data = urllib.parse.urlencode(params)
+        url = self.url
+        if post:
+            data = data.encode()
+        else:
+            url += '?' + data
+            data = None
+        return self.pool.request(url, data).body.decode('utf-8')
+
+    def fetch(self, params, headers={}):
+        """Make a GET query with extra headers and return the Response."""
+        return self.pool.request(
+            self.url + '?' + urllib.parse.urlencode(params), None, headers)
+
+
+class DumpBackend:
+    """Reads pages from a MediaWiki XML dump.
+
+    The dump is accessed with mmap. An index of the titles is built the first
+    time a dump is used and stored in an sqlite database at indexpath, so a
+    page is found with one lookup. For multistream dumps, the index is built
+    from the -index.txt.bz2 file, and only the stream holding the page is
+    decompressed. The page id is reported as the revision id, since pages in
+    a dump never change.
+    """
+    readonly = True
+
+    def __init__(self, path, indexpath):
+        self.path = path
+        self.multistream = path.endswith('.bz2')
+        self.indexpath = indexpath
+        self._file = None
+        self._map = None
+        self._db = None
+        self._namespaces = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if self._map is None:
+            self._file = open(self.path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            if not os.path.exists(self.indexpath):
+                os.makedirs(os.path.dirname(self.indexpath), exist_ok=True)
+                self._buildindex(self.indexpath + '.tmp')
+                os.replace(self.indexpath + '.tmp', self.indexpath)
+            self._db = sqlite3.connect(self.indexpath,
+                                       check_same_thread=False)
+        return self._map
+
+    def _buildindex(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        db = sqlite3.connect(path)
+        db.execute('CREATE TABLE pages (title TEXT PRIMARY KEY, '
+                   'offset INTEGER, id INTEGER) WITHOUT ROWID')
+        db.execute('CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)')
+        if self.multistream:
+            indexpath = re.sub(r'\.xml\.bz2$', '-index.txt.bz2', self.path)
+            if not os.path.exists(indexpath):
+                raise OSError("Index of multistream dump not found: " +
+                              indexpath)
+            with bz2.open(indexpath, 'rt', encoding='utf-8') as file:
+                rows = (line.rstrip('\n').split(':', 2) for line in file)
+                db.executemany('INSERT OR IGNORE INTO pages VALUES (?, ?, ?)',
+                               ((title, int(offset), int(id))
+                                for offset, id, title in rows))
+            header = self._stream(0)
+        else:
+            db.executemany('INSERT OR IGNORE INTO pages VALUES (?, ?, ?)',
+                           self._scan())
+            header = self._map[:self._map.find(b'</siteinfo>') + 11]
+        siteinfo = re.search(rb'<siteinfo>.*?</siteinfo>', header, re.S)
+        if siteinfo:
+            db.execute('INSERT INTO info VALUES (?, ?)',
+                       ('siteinfo', siteinfo.group().decode()))
+        db.commit()
+        db.close()
+
+    def _scan(self):
+        """Yield (title, offset, id) for the pages of an uncompressed dump."""
+        pattern = re.compile(rb'<page>\s*<title>(.*?)</title>.*?<id>(\d+)</id>',
+                             re.S)
+        for match in pattern.finditer(self._map):
+            title = match.group(1).decode()
+            yield (ET.fromstring('<t>%s</t>' % title).text, match.start(),
+                   int(match.group(2)))
+
+    @lru_cache(4)
+    def _stream(self, offset):
+        """Return the decompressed stream of a multistream dump at offset."""
+        decompressor = bz2.BZ2Decompressor()
+        data = []
+        pos = offset
+        while not decompressor.eof and pos < len(self._map):
+            data.append(decompressor.decompress(self._map[pos:pos + 65536]))
+            pos += 65536
+        return b''.join(data)
+
+    def _lookup(self, title):
+        """Return (title, offset, id) for a title, or None."""
+        with self._lock:
+            self._open()
+            row = self._db.execute('SELECT title, offset, id FROM pages '
+                                   'WHERE title = ?', (title,)).fetchone()
+        return row
+
+    def _page(self, title):
+        """Return the <page> element for a title, or None."""
+        row = self._lookup(title)
+        if row is None:
+            return None
+        title, offset, id = row
+        with self._lock:
+            if self.multistream:
+                pages = ET.fromstring(b'<pages>' + self._stream(offset) +
+                                      b'</pages>')
+            else:
+                end = self._map.find(b'</page>', offset) + 7
+                pages = ET.fromstring(b'<pages>' + self._map[offset:end] +
+                                      b'</pages>')
+        for page in pages.iter('page'):
+            if page.findtext('id') == str(id):
+                return page
+        return None
+
+    def _normalize(self, title):
+        title = title.replace('_', ' ').strip()
+        return title[:1].upper() + title[1:]
+
+    def _resolve(self, title, redirects):
+        """Return the <page> element, following a redirect if redirects."""
+        page = self._page(self._normalize(title))
+        if page is not None and redirects and page.find('redirect') is not None:
+            target = page.find('redirect').get('title')
+            return self._page(self._normalize(target.split('#', 1)[0]))
+        return page
+
+    def _siteinfo(self):
+        with self._lock:
+            self._open()
+            row = self._db.execute("SELECT value FROM info "
+                                   "WHERE key = 'siteinfo'").fetchone()
+        return ET.fromstring(row[0]) if row else None
+
+    def _namespace(self, title):
+        """Return the number of the namespace of a title."""
+        if self._namespaces is None:
+            siteinfo = self._siteinfo()
+            self._namespaces = {i.text: int(i.get('key'))
+                                for i in siteinfo.iter('namespace') if i.text
+                                } if siteinfo is not None else {}
+        return self._namespaces.get(title.split(':', 1)[0], 0)
+
+    def query(self, params, post=False):
+        """Answer a query and return the response as a string."""
+        action = params.get('action')
+        if action == 'parse':
+            result = self._parse(params['page'], params.get('redirects'))
+        elif action == 'query' and params.get('meta') == 'siteinfo':
+            result = {'query': self._queryinfo()}
+        elif action == 'query' and params.get('prop') == 'info':
+            result = {'query': self._pageinfo(params['titles'].split('|'),
+                                              params.get('redirects'))}
+        elif action == 'query' and params.get('list') == 'random':
+            result = {'query': {'random': [{'title': self._random()}]}}
+        elif action == 'opensearch':
+            result = [params['search'], self._prefix(params['search'])]
+        elif action == 'paraminfo':
+            result = {'paraminfo': {'modules': []}}
+        else:
+            result = {'error': {'code': 'unsupported',
+                                'info': 'Not supported for a wiki dump'}}
+        return json.dumps(result)
+
+    def _parse(self, title, redirects):
+        page = self._resolve(title, redirects)
+        if page is None:
+            return {'error': {'code': 'missingtitle',
+                              'info': "The page you specified doesn't exist."}}
+        text = page.findtext('revision/text') or ''
+        html, links, extlinks, properties = toHtml(text)
+        return {'parse': {
+            'title': page.findtext('title'),
+            'revid': int(page.findtext('id')),
+            'text': {'*': html},
+            'links': [{'ns': self._namespace(i), 'exists': '', '*': i}
+                      for i in dict.fromkeys(links) if self._lookup(i)],
+            'iwlinks': [],
+            'externallinks': extlinks,
+            'langlinks': [],
+            'properties': properties}}
+
+    def _pageinfo(self, titles, redirects):
+        pages = {}
+        redirected = []
+        for n, title in enumerate(titles):
+            name = self._normalize(title)
+            row = self._lookup(name)
+            if row and redirects:
+                page = self._resolve(name, True)
+                if page is not None and page.findtext('title') != name:
+                    redirected.append({'from': name,
+                                       'to': page.findtext('title')})
+                    row = (page.findtext('title'), 0, int(page.findtext('id')))
+            if row:
+                pages[str(row[2])] = {'title': row[0], 'lastrevid': row[2]}
+            else:
+                pages[str(-n - 1)] = {'title': name, 'missing': ''}
+        normalized = [{'from': i, 'to': self._normalize(i)}
+                      for i in titles if self._normalize(i) != i]
+        return {'normalized': normalized, 'redirects': redirected,
+                'pages': pages}
+
+    def _queryinfo(self):
+        siteinfo = self._siteinfo()
+        base = siteinfo.findtext('base') if siteinfo is not None else ''
+        mainpage = urllib.parse.unquote(base.rsplit('/', 1)[-1])
+        return {'general': {
+            'sitename': siteinfo.findtext('sitename') if siteinfo is not None else '',
+            'base': base,
+            'articlepath': base.rsplit('/', 1)[0] + '/$1',
+            'mainpage': mainpage.replace('_', ' ') or 'Main Page'}}
+
+    def _prefix(self, prefix, limit=10):
+        prefix = self._normalize(prefix)
+        with self._lock:
+            self._open()
+            rows = self._db.execute('SELECT title FROM pages WHERE title >= ? '
+                                    'AND title < ? ORDER BY title LIMIT ?',
+                                    (prefix, prefix + '\U0010ffff', limit))
+            return [i[0] for i in rows]
+
+    def _random(self):
+        with self._lock:
+            self._open()
+            count = self._db.execute('SELECT COUNT(*) FROM pages').fetchone()
+            return self._db.execute('SELECT title FROM pages LIMIT 1 '
+                                    'OFFSET ?',
+                                    (random.randrange(max(count[0], 1)),)
+                                    ).fetchone()[0]
@@ -0,0 +1,81 @@
+"""Sharing of queries made by several threads at the same time."""
+import threading
+from concurrent.futures import Future
+
+
+class InFlight:
+    """Makes identical calls in progress at the same time only once."""
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def call(self, key, func, *args):
+        """Return func(*args), waiting for a call with the same key if any."""
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+        if owner:
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._futures[key]
+        return future.result()
+
+
+class Batcher:
+    """Combines lookups of single keys into calls for many keys.
+
+    func takes a list of keys and returns a dictionary of values by key. A
+    lookup made while no call is in progress is sent at once; lookups made
+    while one is in progress are queued and sent together in the next call,
+    up to size at a time. A key already queued or being looked up shares
+    the result.
+    """
+
+    def __init__(self, func, size=50):
+        self.func = func
+        self.size = size
+        self._futures = {}
+        self._pending = []
+        self._sending = False
+        self._cond = threading.Condition()
+
+    def get(self, key):
+        """Return the value of key, batched with concurrent lookups."""
+        with self._cond:
+            future = self._futures.get(key)
+            if future is None:
+                future = self._futures[key] = Future()
+                self._pending.append(key)
+        while not future.done():
+            with self._cond:
+                if self._sending:
+                    self._cond.wait()
+                    continue
+                self._sending = True
+                batch = self._pending[:self.size]
+                del self._pending[:self.size]
+            self._send(batch)
+        return future.result()
+
+    def _send(self, batch):
+        try:
+            values = self.func(batch)
+            error = None
+        except Exception as e:
+            error = e
+        with self._cond:
+            for key in batch:
+                future = self._futures.pop(key)
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(values.get(key))
+            self._sending = False
+            self._cond.notify_all()
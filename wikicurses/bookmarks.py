@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+
+class Bookmarks:
+    """Bookmarks of a wiki, stored in an sqlite database.
+
+    Each bookmark has a folder, '' for none, and the time it was added, and
+    bookmarks are listed by folder in the order they were added. Changes are
+    made in transactions, so several instances can share the database. The
+    bookmarks file of older versions in the same directory is imported when
+    the database is created.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.oldpath = os.path.join(os.path.dirname(path), 'bookmarks')
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=10,
+                                       check_same_thread=False)
+            with self._db:
+                # key is the casefolded title, for completion
+                self._db.execute('CREATE TABLE IF NOT EXISTS bookmarks ('
+                                 'title TEXT PRIMARY KEY, key TEXT, '
+                                 'folder TEXT, added REAL)')
+                self._db.execute('CREATE INDEX IF NOT EXISTS bookmarks_added '
+                                 'ON bookmarks (folder, added)')
+                self._db.execute('CREATE INDEX IF NOT EXISTS bookmarks_key '
+                                 'ON bookmarks (key)')
+            if os.path.exists(self.oldpath):
+                self._migrate()
+        return self._db
+
+    def _migrate(self):
+        with self._db:
+            # Taking the write lock first, so that of instances started at
+            # once only the first migrates; the others find the file gone
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                with open(self.oldpath) as file:
+                    titles = json.load(file)
+            except (OSError, ValueError):
+                return
+            # Keep the order of the file
+            now = time.time()
+            rows = [(title, title.casefold(), '', now + n * 1e-6)
+                    for n, title in enumerate(titles)]
+            self._db.executemany('INSERT OR IGNORE INTO bookmarks '
+                                 'VALUES (?, ?, ?, ?)', rows)
+            os.replace(self.oldpath, self.oldpath + '.old')
+
+    def _exists(self):
+        return os.path.exists(self.path) or os.path.exists(self.oldpath)
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            db = self._connect()
+            with db:
+                return db.execute(query, params).fetchall()
+
+    def __iter__(self):
+        if not self._exists():
+            return iter(())
+        return (i[0] for i in self._execute('SELECT title FROM bookmarks '
+                                            'ORDER BY folder, added'))
+
+    def entries(self):
+        """Return list of (title, folder, added), by folder and time added."""
+        if not self._exists():
+            return []
+        return self._execute('SELECT title, folder, added FROM bookmarks '
+                             'ORDER BY folder, added')
+
+    def add(self, title, folder=None, added=None):
+        """Add a bookmark, or move it to folder if given and already added."""
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute('INSERT OR IGNORE INTO bookmarks '
+                           'VALUES (?, ?, ?, ?)',
+                           (title, title.casefold(), folder or '',
+                            added or time.time()))
+                if folder is not None:
+                    db.execute('UPDATE bookmarks SET folder = ? '
+                               'WHERE title = ?', (folder, title))
+
+    def discard(self, title):
+        """Remove a bookmark, if present."""
+        if self._exists():
+            self._execute('DELETE FROM bookmarks WHERE title = ?', (title,))
+
+    def complete(self, prefix, limit=10):
+        """Return up to limit bookmarks starting with prefix, ignoring case."""
+        if not self._exists():
+            return []
+        key = prefix.casefold()
+        return [i[0] for i in self._execute(
+            'SELECT title FROM bookmarks WHERE key >= ? AND key < ? '
+            'ORDER BY key LIMIT ?', (key, key + '\U0010ffff', limit))]
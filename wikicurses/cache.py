@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import tempfile
+import threading
+import urllib.parse
+
+from wikicurses.content import Content
+
+
+def _pack(obj):
+    return zlib.compress(json.dumps(obj).encode())
+
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob).decode())
+
+
+def _dump(obj, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file, so readers never see a partial file
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with open(fd, 'w') as file:
+            json.dump(obj, file)
+        os.replace(tmppath, path)
+    except BaseException:
+        os.unlink(tmppath)
+        raise
+
+
+class ArticleCache:
+    """Persistent cache of articles, stored in an sqlite database.
+
+    Entries hold the result of action=parse and the parsed content, keyed by
+    wiki url and title. The least recently used entries are evicted once the
+    total size exceeds maxsize bytes, except for articles saved for offline
+    reading, which are kept until removed. A maxsize of 0 disables caching
+    of articles that are not saved.
+    """
+
+    def __init__(self, wiki, path, maxsize):
+        self.wiki = wiki
+        self.path = path
+        self.maxsize = maxsize
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=10,
+                                       check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS articles ('
+                             'wiki TEXT, title TEXT, revid INTEGER, '
+                             'size INTEGER, atime REAL, result BLOB, '
+                             'content BLOB, saved INTEGER DEFAULT 0, '
+                             'PRIMARY KEY (wiki, title))')
+            columns = [i[1] for i in
+                       self._db.execute('PRAGMA table_info(articles)')]
+            if 'saved' not in columns:  # Created by an older version
+                self._db.execute('ALTER TABLE articles '
+                                 'ADD COLUMN saved INTEGER DEFAULT 0')
+        return self._db
+
+    def get(self, title):
+        """Return tuple (revid, result, content), or None if not cached."""
+        if not os.path.exists(self.path):
+            return None
+        with self._lock:
+            db = self._connect()
+            row = db.execute('SELECT revid, result, content FROM articles '
+                             'WHERE wiki = ? AND title = ?',
+                             (self.wiki, title)).fetchone()
+            if row is None:
+                return None
+            with db:
+                db.execute('UPDATE articles SET atime = ? '
+                           'WHERE wiki = ? AND title = ?',
+                           (time.time(), self.wiki, title))
+        revid, result, content = row
+        return revid, _unpack(result), Content.fromjson(_unpack(content))
+
+    def put(self, title, revid, result, content, saved=False):
+        """Store an article, evicting old entries if over the size limit.
+
+        If saved, or already saved, the article is kept for offline reading.
+        """
+        if not (self.maxsize or saved or os.path.exists(self.path)):
+            return
+        result = _pack(result)
+        content = _pack(content.tojson())
+        size = len(result) + len(content)
+        with self._lock:
+            db = self._connect()
+            with db:
+                row = db.execute('SELECT saved FROM articles '
+                                 'WHERE wiki = ? AND title = ?',
+                                 (self.wiki, title)).fetchone()
+                saved = saved or bool(row and row[0])
+                db.execute('INSERT OR REPLACE INTO articles '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           (self.wiki, title, revid, size, time.time(),
+                            result, content, saved))
+                self._evict(db)
+
+    def save(self, title):
+        """Keep a cached article for offline reading.
+
+        Return False if the article is not in the cache.
+        """
+        if not os.path.exists(self.path):
+            return False
+        with self._lock:
+            db = self._connect()
+            with db:
+                cursor = db.execute('UPDATE articles SET saved = 1 '
+                                    'WHERE wiki = ? AND title = ?',
+                                    (self.wiki, title))
+        return cursor.rowcount > 0
+
+    def discard(self, title):
+        """Remove an article, unless it is saved for offline reading."""
+        if not os.path.exists(self.path):
+            return
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute('DELETE FROM articles '
+                           'WHERE wiki = ? AND title = ? AND NOT saved',
+                           (self.wiki, title))
+
+    def _evict(self, db):
+        total = db.execute('SELECT TOTAL(size) FROM articles '
+                           'WHERE NOT saved').fetchone()[0]
+        if total <= self.maxsize:
+            return
+        expired = []
+        for wiki, title, size in db.execute(
+                'SELECT wiki, title, size FROM articles WHERE NOT saved '
+                'ORDER BY atime'):
+            if total <= self.maxsize:
+                break
+            expired.append((wiki, title))
+            total -= size
+        db.executemany('DELETE FROM articles WHERE wiki = ? AND title = ?',
+                       expired)
+
+    def clear(self):
+        """Remove all articles of this wiki not saved for offline reading."""
+        if not os.path.exists(self.path):
+            return
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute('DELETE FROM articles WHERE wiki = ? AND NOT saved',
+                           (self.wiki,))
+
+
+class SiteInfoCache:
+    """The general siteinfo of a wiki, saved to a json file.
+
+    It is considered current for maxage seconds.
+    """
+    maxage = 24 * 60 * 60
+
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, stale=False):
+        """Return the saved siteinfo, or None if missing or old unless stale."""
+        try:
+            with open(self.path) as file:
+                saved, general = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not stale and saved < time.time() - self.maxage:
+            return None
+        return general
+
+    def put(self, general):
+        """Save the siteinfo."""
+        _dump([time.time(), general], self.path)
+
+    def clear(self):
+        """Remove the saved siteinfo."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class EndpointCache:
+    """The api.php urls of wikis by host, saved to a json file.
+
+    Hosts are learned from the interwiki maps of wikis, recorded in seeded,
+    and from discovery.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as file:
+                    self._entries = json.load(file)
+            except (OSError, ValueError):
+                self._entries = {'apis': {}, 'seeded': []}
+        return self._entries
+
+    def get(self, netloc):
+        """Return the api url for a host, or None."""
+        with self._lock:
+            return self._load()['apis'].get(netloc)
+
+    def seeded(self, apiurl):
+        """Return whether the interwiki map of a wiki has been added."""
+        with self._lock:
+            return apiurl in self._load()['seeded']
+
+    def update(self, apis, seededby=None):
+        """Add dictionary of api urls by host, from the wiki seededby."""
+        with self._lock:
+            entries = self._load()
+            entries['apis'].update(apis)
+            if seededby:
+                entries['seeded'].append(seededby)
+            _dump(entries, self.path)
+
+
+class FeedCache:
+    """Featured feeds of a wiki, saved to a json file for each feed.
+
+    A feed is saved as parsed by parseFeed(), with the ETag and Last-Modified
+    headers of the response to revalidate it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _path(self, feed):
+        return os.path.join(self.path,
+                            urllib.parse.quote(feed, safe='') + '.json')
+
+    def get(self, feed):
+        """Return dictionary with etag, modified and feed, or None."""
+        try:
+            with open(self._path(feed)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def names(self):
+        """Return the names of the saved feeds."""
+        try:
+            files = os.listdir(self.path)
+        except OSError:
+            return []
+        return sorted(urllib.parse.unquote(i[:-len('.json')])
+                      for i in files if i.endswith('.json'))
+
+    def put(self, feed, parsed, etag=None, modified=None):
+        """Save a feed with the validators of the response."""
+        _dump({'etag': etag, 'modified': modified, 'feed': parsed},
+              self._path(feed))
+
+    def clear(self):
+        """Remove all saved feeds."""
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                os.remove(os.path.join(self.path, name))
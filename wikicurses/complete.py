@@ -0,0 +1,84 @@
+"""Completion for shells, without loading the interface.
+
+Only what is needed to answer is imported. Search suggestions come from the
+same bookmarks, title index and suggestion cache as Wiki.local_sugestions,
+and the wiki is only queried if those have fewer than ten. When offline, the
+wiki is never queried, and only saved feeds are completed.
+"""
+import sys
+import json
+import argparse
+
+from wikicurses import settings
+from wikicurses.bookmarks import Bookmarks
+from wikicurses.cache import FeedCache
+from wikicurses.suggest import SuggestionCache, TitleIndex, merge
+
+
+def _apiurl(wiki):
+    if not wiki:
+        wiki = settings.conf['general']['default']
+    if wiki in settings.conf:
+        return settings.conf[wiki]['url']
+    return wiki
+
+
+def _query(url, **params):
+    # Imported here, since most completions do not need the network
+    import http.cookiejar
+    from wikicurses.backend import openBackend
+    from wikicurses.transport import ConnectionPool, useragent
+    pool = ConnectionPool(http.cookiejar.CookieJar(),
+                          {'User-agent': useragent}, settings.timeout)
+    try:
+        return openBackend(url, pool).query(params)
+    finally:
+        pool.close()
+
+
+def complete(kind, text, wiki=None):
+    """Return list of completions of kind 'search', 'feed' or 'wiki'."""
+    if kind == 'wiki':
+        return list(settings.wikis())
+    url = _apiurl(wiki)
+    configpath = settings.wikiconfigpath(url)
+    if kind == 'feed' and settings.offline:
+        return FeedCache(configpath + '/feeds').names()
+    elif kind == 'feed':
+        result = json.loads(_query(url, action="paraminfo",
+                                   modules="featuredfeed",
+                                   format="json"))["paraminfo"]
+        if not result["modules"]:
+            return []
+        return next(i for i in result["modules"][0]["parameters"]
+                    if i["name"] == "feed")["type"]
+    cache = SuggestionCache(configpath + '/suggestions.json')
+    titles = TitleIndex(configpath + '/titles.json')
+    bmarks = Bookmarks(configpath + '/bookmarks.sqlite').complete(text)
+    cached = cache.get(text)
+    sugestions = merge(cached or (), bmarks, titles.complete(text))
+    if cached is None and len(sugestions) < 10 and not settings.offline:
+        result = json.loads(_query(url, action="opensearch", search=text,
+                                   format="json"))[1]
+        cache.put(text, result)
+        titles.update(result)
+        titles.save()
+        sugestions = merge(result, sugestions)
+    return sugestions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print completions for wikicurses arguments.")
+    parser.add_argument('kind', choices=('search', 'feed', 'wiki'))
+    parser.add_argument('text', nargs='?', default='')
+    parser.add_argument('-w', '--wiki', help='wiki name or api url')
+    args = parser.parse_args()
+    try:
+        print(*complete(args.kind, args.text, args.wiki), sep='\n')
+    except OSError as e:
+        sys.exit('Error: ' + str(e))
+
+
+if __name__ == '__main__':
+    main()
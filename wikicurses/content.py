@@ -0,0 +1,122 @@
+import bisect
+from array import array
+
+
+class Content:
+    """Formatted text of a page.
+
+    The text is kept as a single string, with the start offset and format
+    of each run of text in arrays, rather than as a list of (format, text)
+    pairs. Indexing and iterating give (format, text) tuples.
+    """
+    __slots__ = ('text', 'starts', 'formats')
+
+    def __init__(self, items=()):
+        self.text = ''
+        self.starts = array('I')
+        self.formats = array('H')
+        self.extend(items)
+
+    def extend(self, items):
+        """Append runs from an iterable of (format, text) pairs."""
+        texts = [self.text]
+        end = len(self.text)
+        for tformat, text in items:
+            self.starts.append(end)
+            self.formats.append(tformat)
+            texts.append(text)
+            end += len(text)
+        self.text = ''.join(texts)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.starts)
+        return (self.formats[index],
+                self.text[self.starts[index]:self.start(index + 1)])
+
+    def __iter__(self):
+        for i in range(len(self.starts)):
+            yield self[i]
+
+    def start(self, index):
+        """Return the offset in text of a run, or its length for len(self)."""
+        if index >= len(self.starts):
+            return len(self.text)
+        return self.starts[index]
+
+    def run(self, offset):
+        """Return the index of the run containing offset in text."""
+        return bisect.bisect_right(self.starts, offset) - 1
+
+    def tojson(self):
+        """Return the content as an object that can be encoded to json."""
+        return [self.text, self.starts.tolist(), self.formats.tolist()]
+
+    @classmethod
+    def fromjson(cls, obj):
+        """Return the content from tojson(), or from a list of pairs."""
+        if not obj or not isinstance(obj[0], str):  # Stored by older versions
+            return cls(obj)
+        content = cls()
+        content.text = obj[0]
+        content.starts.extend(obj[1])
+        content.formats.extend(obj[2])
+        return content
+
+
+class LazyContent(Content):
+    """Content whose runs are converted to text only when first needed.
+
+    Runs are given as (format, source, convert) tuples, and the text of a
+    run is convert(source), or source if convert is None. Indexing converts
+    only that run, so runs are converted as they are displayed. The text as
+    a whole, and so the offsets of the runs, is only made when used, such as
+    for searching.
+    """
+    __slots__ = ('_runs', '_texts', '_joined')
+
+    def __init__(self, runs):
+        self._runs = list(runs)
+        self._texts = [None] * len(self._runs)
+        self._joined = None
+        self.formats = array('H', (i[0] for i in self._runs))
+
+    def _text(self, index):
+        text = self._texts[index]
+        if text is None:
+            tformat, source, convert = self._runs[index]
+            text = self._texts[index] = convert(source) if convert else source
+        return text
+
+    def _join(self):
+        if self._joined is None:
+            texts = [self._text(i) for i in range(len(self._runs))]
+            starts = array('I')
+            end = 0
+            for text in texts:
+                starts.append(end)
+                end += len(text)
+            self._joined = ''.join(texts), starts
+        return self._joined
+
+    @property
+    def text(self):
+        return self._join()[0]
+
+    @property
+    def starts(self):
+        return self._join()[1]
+
+    def extend(self, items):
+        raise TypeError("LazyContent cannot be extended")
+
+    def __len__(self):
+        return len(self._runs)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self._runs)
+        return self.formats[index], self._text(index)
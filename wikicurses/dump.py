@@ -0,0 +1,141 @@
+"""Export of articles to text files, without the interface."""
+import os
+import sys
+import time
+import multiprocessing
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                as_completed)
+
+from wikicurses import settings
+from wikicurses.wiki import WikiError, articleContent
+
+_ansisettings = {'bold': 1, 'italics': 3, 'underline': 4, 'blink': 5,
+                 'standout': 7, 'strikethrough': 9}
+_ansicolors = ('black', 'dark red', 'dark green', 'brown', 'dark blue',
+               'dark magenta', 'dark cyan', 'light gray', 'dark gray',
+               'light red', 'light green', 'yellow', 'light blue',
+               'light magenta', 'light cyan', 'white')
+
+
+def _color(name, base):
+    if name not in _ansicolors:
+        return []
+    n = _ansicolors.index(name)
+    return [base + n if n < 8 else base + 60 + n - 8]
+
+
+def _escape(tformat):
+    """Return the ANSI escape sequence for the display settings of tformat."""
+    attribute = settings.getAttribute(tformat)
+    codes = [_ansisettings[i] for i in attribute.settings
+             if i in _ansisettings]
+    codes += _color(attribute.fgcolor, 30) + _color(attribute.bgcolor, 40)
+    return '\33[' + ';'.join(str(i) for i in codes) + 'm' if codes else ''
+
+
+def formatText(title, content, ansi=False):
+    """Return the text of an article, with ANSI escape sequences if ansi."""
+    if not ansi:
+        return title + '\n\n' + content.text
+    text = [title, '\n\n']
+    for tformat, string in content:
+        escape = _escape(tformat)
+        if escape:
+            text.extend((escape, string, '\33[0m'))
+        else:
+            text.append(string)
+    return ''.join(text)
+
+
+def filename(title):
+    """Return the name of the file a page is written to.
+
+    '/', which cannot be in a file name, and '%' are percent-encoded, so
+    different titles have different names.
+    """
+    return title.replace('%', '%25').replace('/', '%2F') + '.txt'
+
+
+def dump(wiki, titles, outdir, ansi=False, jobs=4):
+    """Fetch articles and write them to outdir.
+
+    Pages are downloaded by jobs threads and parsed by jobs processes, and
+    up to date articles in the cache are reused. Progress and failures are
+    reported on stderr. Return a dictionary of errors by title.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    start = time.time()
+    written = size = 0
+    failed = {}
+
+    def write(title, content):
+        nonlocal written, size
+        text = formatText(title, content, ansi)
+        with open(os.path.join(outdir, filename(title)), 'w') as file:
+            file.write(text)
+        written += 1
+        size += len(text)
+        print('[%d/%d] %s' % (written + len(failed), len(titles), title),
+              file=sys.stderr)
+
+    def fail(title, error):
+        failed[title] = str(error)
+        print('[%d/%d] %s: Error: %s' % (written + len(failed), len(titles),
+                                         title, error), file=sys.stderr)
+
+    try:
+        revids = wiki._lastrevids(titles)
+    except (WikiError, OSError) as e:
+        for title in titles:
+            fail(title, e)
+        return failed
+
+    fetch = []
+    for title in titles:
+        cached = wiki.cache.get(title)
+        if revids[title] is None:
+            fail(title, 'Page Not Found')
+        elif cached and cached[0] == revids[title]:
+            revid, result, content = cached
+            write(result.get('title', title), content)
+        else:
+            fetch.append(title)
+
+    # Forking while the download threads hold locks could deadlock the
+    # workers, so they are started as new processes
+    with ThreadPoolExecutor(jobs) as threads, \
+            ProcessPoolExecutor(jobs, multiprocessing.get_context('spawn')
+                                ) as processes:
+        fetches = {threads.submit(wiki._parse, i): i for i in fetch}
+        parses = {}
+        for future in as_completed(fetches):
+            title = fetches[future]
+            try:
+                result = future.result()
+            except (WikiError, OSError) as e:
+                fail(title, e)
+                continue
+            if not result:
+                fail(title, 'Page Not Found')
+                continue
+            parses[processes.submit(articleContent, result)] = title, result
+        for future in as_completed(parses):
+            title, result = parses[future]
+            try:
+                content = future.result()
+            except Exception as e:
+                fail(title, e)
+                continue
+            if 'revid' in result:
+                wiki.cache.put(title, result['revid'], result, content)
+            write(result.get('title', title), content)
+
+    elapsed = time.time() - start
+    print("Wrote %d pages (%d KiB) to %s in %.1f s, %.1f pages/s." %
+          (written, size // 1024, outdir, elapsed,
+           written / elapsed if elapsed else 0))
+    if failed:
+        print("%d failed:" % len(failed))
+        for title, error in failed.items():
+            print('  %s: %s' % (title, error))
+    return failed
@@ -1,10 +1,17 @@
+import io
 import re
+import xml.etree.ElementTree as ET
 from collections import OrderedDict
 
 import bs4
+try:
+    import lxml.etree
+except ImportError:
+    lxml = None
 
 from wikicurses import formats
 from wikicurses import settings
+from wikicurses.content import Content
 
 skipclass = ('wiki-sidebar', 'infobox', 'mw-editsection', 'editsection',
              'wikitable', 'thumb', 'gallery', 'article-thumb', 'infobox_v2',
@@ -16,89 +23,315 @@ if settings.hide_references:
     skipsection += ('References',)
 
 
-def parseArticle(html):
-    """Parse article html and return list of  (format, text) tuples."""
-    html = html.replace('\t', ' ')
-    soup = bs4.BeautifulSoup(html, 'lxml')
-    # Turn into tuple since the iterator is being modified
-    for i in tuple(soup.strings):
-        if not {'pre', 'code'}.intersection(j.name for j in i.parents):
-            i.replace_with(i.replace('\n', ''))
-    for i in soup.find_all('p'):
-        i.insert_after(soup.new_string('\n\n'))
-    for i in soup.find_all(['h2', 'h3', 'h4', 'h5', 'h6', 'br', 'pre']):
-        i.insert_after(soup.new_string('\n'))
-    for i in soup.find_all('div'):
-        if i.text and not i.find_all('div'):
-            i.insert_after(soup.new_string('\n'))
-    for i in soup.find_all('li'):
-        if i.parent.name == 'ol':
-            num = i.parent.find_all('li').index(i) + 1
-            i.insert_before(soup.new_string(str(num) + '. '))
-        else:
-            i.insert_before(soup.new_string('• '))
-        i.insert_after(soup.new_string('\n'))
-        if 'li' not in (j.name for j in i.next_siblings): # Last item in list
-            i.insert_after(soup.new_string('\n'))
+# The tree builder of Beautiful Soup, which also needs lxml by default
+_soupbuilder = 'lxml' if lxml else 'html.parser'
 
-    for i in soup.find_all(True, class_=skipclass):
-        i.decompose()
-    for i in soup.find_all('script'):
-        i.decompose()
-    for i in soup.find_all('h2'):
-        if i.text in skipsection:
-            for j in tuple(i.next_elements):
-                # Test it is not a str to avoid using str.find() by accident
-                if not isinstance(j, str) and (j.name == 'h2' or j.find('h2')):
-                    break
-                j.extract()
-            i.decompose()
+# Tags adding to the format of text inside them
+_tagformats = {i.name: int(i) for i in formats}
+_tagformats.update({'h3': formats.h, 'h4': formats.h, 'h5': formats.h,
+                    'h6': formats.h, 'strong': formats.b, 'em': formats.i})
+# Tags whose strings are not part of the text of the document
+_nontext = ('rt', 'rp', 'style', 'script', 'template')
+# Tags followed by a line break; the first in the tuple by two
+_breaktags = ('p', 'h2', 'h3', 'h4', 'h5', 'h6', 'br', 'pre')
 
-    items = []
-    for item in soup.strings:
-        if not item:
-            continue
 
-        if isinstance(item, bs4.element.Comment):
-            continue # Strip out html comments
+def _skipped(classes):
+    return any(i in skipclass for i in classes)
+
+
+class _Element:
+    __slots__ = ('name', 'tformat', 'verbatim', 'nontext', 'hidden',
+                 'olstart', 'divstart', 'capture', 'morelis')
+
 
-        partags = {i.name for i in item.parents}
-        tformat = sum(
-            formats[i] for i in set(i.name for i in formats).intersection(partags))
-        if [i for i in partags if re.fullmatch('h[3-6]', i)]:
-            tformat |= formats.h
-        # Make <strong>/<em> use same formats as <b>/<i>
-        if 'strong' in partags:
-            tformat |= formats.b
-        if 'em' in partags:
-            tformat |= formats.i
+class _ArticleParser:
+    """Converts the document tree of an article to content in a single pass.
 
+    The tree is walked in document order with start(), data() and end()
+    calls. The format, the list numbering and the skipped classes and
+    sections are tracked on a stack of open elements instead of by searching
+    the tree for every string. Subclasses implement walk() for a particular
+    tree, and pass breaks, a function returning whether a node is or
+    contains an h2 that is not skipped, which ends a skipped section.
+    """
+
+    def __init__(self, breaks):
+        self.breaks = breaks
+        self.items = []
+        self.lastchar = ''
+        self.capture = None  # Content of the h2 being read
+        self.skipping = False  # Inside a section from skipsection
+        self.nli = self.ntext = self.ndiv = 0
+        root = _Element()
+        root.name = None
+        root.tformat = 0
+        root.verbatim = root.nontext = root.hidden = False
+        self.stack = [root]
+
+    def start(self, node, name, classes, style, morelis):
+        """Open an element; morelis is whether an li follows it in its parent."""
+        parent = self.stack[-1]
+        if name == 'li':
+            self.nli += 1
+            if parent.name == 'ol':
+                self._emit(parent, str(self.nli - parent.olstart) + '. ')
+            else:
+                self._emit(parent, '• ')
+
+        element = _Element()
+        element.name = name
+        element.tformat = parent.tformat | _tagformats.get(name, 0)
         # Handle divs with padding or borders defined in css style
-        styledivs = item.findParents('div', style=True)
-        stylekeys = [i.split(':', 1)[0].strip()
-                for div in styledivs for i in div.get('style').split(';')]
-        if 'padding' in stylekeys:
-            tformat |= formats.divpadding
-        if 'border' in stylekeys:
-            tformat |= formats.divborder
+        if name == 'div' and style is not None:
+            stylekeys = [i.split(':', 1)[0].strip() for i in style.split(';')]
+            if 'padding' in stylekeys:
+                element.tformat |= formats.divpadding
+            if 'border' in stylekeys:
+                element.tformat |= formats.divborder
+        element.verbatim = parent.verbatim or name in ('pre', 'code')
+        element.nontext = parent.nontext or name in _nontext
+        element.hidden = (parent.hidden or name == 'script' or
+                          _skipped(classes))
+        element.morelis = morelis
+        if name == 'ol':
+            element.olstart = self.nli
+        elif name == 'div':
+            self.ndiv += 1
+            element.divstart = (self.ntext, self.ndiv)
 
-        # Added specifically for handling spaces between removed references
-        if items and items[-1][1] and (items[-1][1][-1] == item[0] == ' '):
-            item = item[1:]
+        if self.skipping and not element.hidden and self.breaks(node):
+            self.skipping = False
+        element.capture = (name == 'h2' and not element.hidden and
+                           self.capture is None)
+        if element.capture:
+            self.capture = []
+        self.stack.append(element)
+
+    def data(self, text):
+        element = self.stack[-1]
+        if element.nontext:
+            return
+        if not element.verbatim:
+            text = text.replace('\n', '')
+        if text:
+            self.ntext += 1
+            self._emit(element, text)
+
+    def end(self):
+        element = self.stack.pop()
+        parent = self.stack[-1]
+        if element.capture:
+            captured, self.capture = self.capture, None
+            if ''.join(text for tformat, text in captured) in skipsection:
+                self.skipping = True
+            else:
+                for tformat, text in captured:
+                    self._add(tformat, text)
 
+        name = element.name
+        if name in _breaktags:
+            self.ntext += 1
+            self._emit(parent, '\n\n' if name == 'p' else '\n')
+        elif name == 'div':
+            # Only divs with text and without divs inside them
+            ntext, ndiv = element.divstart
+            if self.ntext > ntext and self.ndiv == ndiv:
+                self._emit(parent, '\n')
+        elif name == 'li':
+            # Extra line break after the last item in a list
+            self._emit(parent, '\n' if element.morelis else '\n\n')
+
+    def _emit(self, element, text):
+        if element.hidden or self.skipping:
+            return
+        if self.capture is not None:
+            self.capture.append((element.tformat, text))
+        else:
+            self._add(element.tformat, text)
+
+    def _add(self, tformat, text):
+        # Added specifically for handling spaces between removed references
+        if self.lastchar == ' ' and text[0] == ' ':
+            text = text[1:]
         # If format same as previous, combine
-        if items and items[-1][0] == tformat:
-            items[-1][1] += str(item)
+        if self.items and self.items[-1][0] == tformat:
+            self.items[-1][1].append(text)
         else:
-            items.append([tformat, str(item)])
+            self.items.append([tformat, [text]])
+            self.lastchar = ''
+        if text:
+            self.lastchar = text[-1]
 
-    return items
+    def result(self):
+        return Content((tformat, ''.join(text)) for tformat, text in self.items)
+
+
+class _SoupArticleParser(_ArticleParser):
+
+    def __init__(self, soup):
+        h2s = None
+
+        # A closure rather than a method, so the parser is not in a cycle
+        def breaks(tag):
+            nonlocal h2s
+            if h2s is None:
+                h2s = set()
+                for i in soup.find_all('h2'):
+                    tags = [i] + [j for j in i.parents if j is not soup]
+                    if not any(_skipped(j.get('class', ())) for j in tags):
+                        h2s.update(id(j) for j in tags)
+            return id(tag) in h2s
+        super().__init__(breaks)
+
+    @staticmethod
+    def _children(tag):
+        """Return iterator of (child, whether an li follows it)."""
+        lastli = max((n for n, i in enumerate(tag.contents)
+                      if i.name == 'li'), default=-1)
+        return ((i, n < lastli) for n, i in enumerate(tag.contents))
+
+    def walk(self, tag):
+        # A stack of the children left of each open tag instead of
+        # recursion, as pages can be nested deeper than the recursion limit
+        stack = [self._children(tag)]
+        while stack:
+            for i, morelis in stack[-1]:
+                if isinstance(i, bs4.element.Tag):
+                    self.start(i, i.name, i.get('class', ()), i.get('style'),
+                               morelis)
+                    stack.append(self._children(i))
+                    break
+                elif type(i) in (bs4.element.NavigableString,
+                                 bs4.element.CData):
+                    self.data(i)
+            else:
+                stack.pop()
+                if stack:
+                    self.end()
+
+
+class _LxmlArticleParser(_ArticleParser):
+
+    def __init__(self, root):
+        h2s = None
+
+        # As in _SoupArticleParser
+        def breaks(element):
+            nonlocal h2s
+            if h2s is None:
+                h2s = set()
+                for i in root.iter('h2'):
+                    elements = [i] + list(i.iterancestors())
+                    if not any(_skipped(j.get('class', '').split())
+                               for j in elements):
+                        h2s.update(elements)
+            return element in h2s
+        super().__init__(breaks)
+
+    def _data(self, text, preserve):
+        # Collapse whitespace-only strings outside of <pre> like bs4 does
+        if not preserve and not text.strip(' \n\t\f\r'):
+            text = '\n' if '\n' in text else ' '
+        self.data(text)
+
+    @staticmethod
+    def _children(element):
+        """Return iterator of (child, whether an li follows it)."""
+        lastli = max((n for n, i in enumerate(element) if i.tag == 'li'),
+                     default=-1)
+        return ((i, n < lastli) for n, i in enumerate(element))
+
+    def walk(self, element, preserve=False):
+        if element.text:
+            self._data(element.text, preserve)
+        # Without recursion, like _SoupArticleParser.walk()
+        stack = [(element, self._children(element), preserve)]
+        while stack:
+            children, preserve = stack[-1][1:]
+            for i, morelis in children:
+                # Comments and processing instructions do not have a str tag
+                if isinstance(i.tag, str):
+                    self.start(i, i.tag, i.get('class', '').split(),
+                               i.get('style'), morelis)
+                    inner = preserve or i.tag in ('pre', 'textarea')
+                    if i.text:
+                        self._data(i.text, inner)
+                    stack.append((i, self._children(i), inner))
+                    break
+                if i.tail:
+                    self._data(i.tail, preserve)
+            else:
+                closed = stack.pop()[0]
+                if stack:
+                    self.end()
+                    if closed.tail:
+                        self._data(closed.tail, stack[-1][2])
+
+
+def _lxmlTree(html):
+    """Return the lxml tree of html, or False if libxml2 gave up on it.
+
+    libxml2 stops at a limit of depth, silently dropping the rest of the
+    page. huge_tree raises the limit, but pages nested deeper still fail.
+    """
+    # Not shared, as the error log is per parser
+    htmlparser = lxml.etree.HTMLParser(encoding='utf-8', huge_tree=True)
+    root = lxml.etree.HTML(html.encode(), htmlparser)
+    if any(i.level == lxml.etree.ErrorLevels.FATAL
+           for i in htmlparser.error_log):
+        return False
+    return root
+
+
+def parseArticle(html):
+    """Parse article html and return its Content."""
+    html = html.replace('\t', ' ')
+    root = False
+    if settings.parser == 'lxml' and lxml:
+        root = _lxmlTree(html)
+        if root is None:  # No elements in document
+            return Content()
+    if root is not False:
+        parser = _LxmlArticleParser(root)
+        parser.start(root, root.tag, (), None, False)
+        parser.walk(root)
+        parser.end()
+    else:
+        soup = bs4.BeautifulSoup(html, _soupbuilder)
+        parser = _SoupArticleParser(soup)
+        parser.walk(soup)
+    return parser.result()
+
+
+def parseFeed(data):
+    """Parse a featured feed, an RSS document, without building a tree.
+
+    Return dictionary with the title and description of the feed, and items,
+    a list of [title, description] pairs, with descriptions as html.
+    """
+    feed = {'title': '', 'description': '', 'items': []}
+    parser = ET.iterparse(io.BytesIO(data), ('start', 'end'))
+    depth = 0
+    for event, element in parser:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if element.tag == 'item':
+            feed['items'].append([element.findtext('title', ''),
+                                  element.findtext('description', '')])
+            element.clear()
+        elif depth == 2 and element.tag in ('title', 'description'):
+            # Of the channel, rss > channel > title
+            feed[element.tag] = element.text or ''
+    return feed
 
 
 def parseFeature(html):
     """Parse featured feed html by striping out html tags."""
     # TODO: Support html tags like <b>
-    text = bs4.BeautifulSoup(html, 'lxml').text.strip() + '\n\n'
+    text = bs4.BeautifulSoup(html, _soupbuilder).text.strip() + '\n\n'
     text = re.sub('\n\n+', '\n\n', text)
     return text
 
@@ -119,7 +352,7 @@ def _processDisambigSection(section):
 def parseDisambig(html):
     """Parse disambiguation page and return list of (article, text) tuples."""
     sections = OrderedDict()
-    soup = bs4.BeautifulSoup(html, 'lxml')
+    soup = bs4.BeautifulSoup(html, _soupbuilder)
     for i in soup.find_all(True, class_=skipclass):
         i.decompose()
     sections[''] = _processDisambigSection(soup)
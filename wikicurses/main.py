@@ -1,15 +1,25 @@
 import os
 import re
+import sys
+import queue
+import bisect
+import difflib
 import argparse
 import tempfile
+import threading
 import subprocess
+import collections
 import urllib.parse
 
 import urwid
 
 from wikicurses import formats, settings
-from wikicurses.wiki import Wiki, WikiError
+from wikicurses.wiki import Wiki, WikiError, stop_prefetching
+from wikicurses.content import LazyContent
 from wikicurses.htmlparse import parseDisambig
+from wikicurses.complete import complete
+from wikicurses.dump import dump
+from wikicurses.stats import stats, stages, Trace
 
 
 def executeCommand(cmd):
@@ -43,15 +53,29 @@ class SearchBox(urwid.Edit):
             closeOverlay()
             openPage(self.edit_text)
         elif key == 'tab':
-            matches = wiki.search_sugestions(self.edit_text)
-            match = tabComplete(self.edit_text, matches)
-            self.edit_text = match
-            self.edit_pos = len(match)
+            text = self.edit_text
+            matches = wiki.local_sugestions(text)
+            if matches:
+                self._complete(text, matches)
+            if len(matches) < 10:
+                # Query the wiki in the background, completing with the
+                # result only if nothing was known locally
+                def complete(sugestions):
+                    if not matches and self.edit_text == text:
+                        self._complete(text, sugestions)
+                sugestionloader.start(
+                    lambda: wiki.search_sugestions(text), complete,
+                    lambda error: None)
         elif key == 'esc':
             closeOverlay()
         else:
             return super().keypress(size, key)
 
+    def _complete(self, text, matches):
+        match = tabComplete(text, matches)
+        self.edit_text = match
+        self.edit_pos = len(match)
+
 
 class SelectorBox(urwid.ListBox):
 
@@ -100,7 +124,15 @@ class Bmarks(SelectorBox):
 
     def _items(self):
         self.deleted = []
-        return wiki.bmarks
+        self.entries = {}
+        folder = ''
+        for title, entryfolder, added in wiki.bmarks.entries():
+            if entryfolder != folder:
+                folder = entryfolder
+                addPalette(formats.h)
+                yield urwid.Text((formats.h, folder))
+            self.entries[title] = (entryfolder, added)
+            yield title
 
     def _select(self, name):
         openPage(name)
@@ -109,10 +141,11 @@ class Bmarks(SelectorBox):
         # Undo Delete
         if key == 'u' and self.deleted:
             index, item = self.deleted.pop()
-            wiki.bmarks.add(item.label)
+            wiki.bmarks.add(item.label, *self.entries[item.label])
             self.body.insert(index, item)
             self.set_focus(index)
-        elif key in ('meta [', 'x') and self.focus:
+        elif key in ('meta [', 'x') and isinstance(self.focus,
+                                                   urwid.RadioButton):
             wiki.bmarks.discard(self.focus.label)
             self.deleted.append((self.focus_position, self.focus))
             self.body.remove(self.focus)
@@ -123,6 +156,14 @@ class Bmarks(SelectorBox):
 class Links(SelectorBox):
     title = "Links"
 
+    def __init__(self):
+        super().__init__()
+        urwid.connect_signal(self.body, 'modified', self._prefetch)
+
+    def _prefetch(self):
+        if self.focus:
+            wiki.prefetch([self.focus.label])
+
     def _items(self):
         return page.links
 
@@ -146,8 +187,7 @@ class Iwlinks(SelectorBox):
         if name == "Main page":
             name = ''
         url = dict(page.iwlinks)[name]
-        openWiki(Wiki.fromPageUrl(url))
-        openPage(name)
+        openPageUrl(url, name)
 
 
 class Langs(SelectorBox):
@@ -158,8 +198,7 @@ class Langs(SelectorBox):
 
     def _select(self, lang):
         url, name = page.langlinks[lang]
-        openWiki(Wiki.fromPageUrl(url))
-        openPage(name)
+        openPageUrl(url, name)
 
 
 class Extlinks(SelectorBox):
@@ -180,6 +219,7 @@ class Wikis(SelectorBox):
             yield name, wiki.siteurl == url, name
 
     def _select(self, name):
+        saveView()  # With the wiki, if opening its main page fails
         openWiki(name)
         openPage()
 
@@ -219,7 +259,10 @@ class Ex(urwid.Edit):
             if self.mode == 'ex':
                 matches = [i for i in cmds if i.startswith(self.edit_text)]
                 match = tabComplete(self.edit_text, matches)
+                # Left first, so notifications of the command are kept
+                self.exitexmode()
                 processCmd(*match.split())
+                return
             if self.mode == 'search':
                 self.highlightText(self.edit_text)
             self.exitexmode()
@@ -252,7 +295,184 @@ class Ex(urwid.Edit):
         self.set_edit_text(text)
 
 
+class Loading(urwid.Filler):
+    """Shown while a page loads; esc cancels loading."""
+    widgetnames = []
+
+    def selectable(self):
+        return True
+
+    def keypress(self, size, key):
+        ex.notify('') # Clear any notification
+        cmdmap = settings.conf['keymap']
+        if key == 'esc':
+            cancelLoad()
+        elif key == ':':
+            ex.enterexmode()
+        elif key in cmdmap and cmdmap[key]:
+            processCmd(cmdmap[key])
+        else:
+            return key
+
+
+class Loader:
+    """Run blocking calls in a thread, passing results to the main loop.
+
+    Only the result of the most recently started call is delivered; starting
+    a new call or cancelling discards any call in flight. While a call is in
+    flight, the spinner characters are shown in the progress area.
+    """
+
+    def __init__(self, spinner='|/-\\'):
+        self.spinner = spinner
+        self.active = None
+        self.generation = 0
+        self.results = queue.Queue()
+        self.pipe = None
+        self.ticks = 0
+
+    def start(self, func, callback, errback):
+        """Call func() in a thread, then callback(result) in the main loop.
+
+        If func raises WikiError or OSError, errback(error) is called instead.
+        """
+        if self.pipe is None:
+            self.pipe = loop.watch_pipe(self._done)
+        wasactive = self.active is not None
+        self.generation += 1
+        self.active = generation = self.generation
+
+        def run():
+            try:
+                result, error = func(), None
+            except Exception as e:
+                result, error = None, e
+            self.results.put((generation, callback, errback, result, error))
+            os.write(self.pipe, b'.')
+
+        threading.Thread(target=run, daemon=True).start()
+        if not wasactive:
+            self._tick()
+
+    def cancel(self):
+        self.active = None
+
+    def _tick(self, *args):
+        if self.active is not None and self.spinner:
+            progress.set_text(self.spinner[self.ticks % len(self.spinner)])
+            self.ticks += 1
+            loop.set_alarm_in(.1, self._tick)
+
+    def _done(self, data):
+        while not self.results.empty():
+            generation, callback, errback, result, error = self.results.get()
+            if generation != self.active:
+                continue
+            self.active = None
+            if error is None:
+                callback(result)
+            elif isinstance(error, (WikiError, OSError)):
+                errback(error)
+            else:
+                raise error
+        return True
+
+
+View = collections.namedtuple('View', ('title', 'wiki', 'body', 'header',
+                                       'page', 'progress'))
+
+
+class Views:
+    """Displayed pages of the history, by position in the history.
+
+    The widgets are kept as they are, so going back shows a page without
+    parsing or rendering it again, with the same scroll position and search
+    highlighting. The least recently shown views are dropped when their total
+    cost exceeds size, where a view costs one, plus one for each charsperview
+    characters of the text of an article.
+    """
+    charsperview = 100000
+
+    def __init__(self, size):
+        self.size = size
+        self._views = collections.OrderedDict()
+        self._cost = 0
+
+    def _viewcost(self, view):
+        if isinstance(view.body, Pager) and view.page.article:
+            return 1 + len(view.page.content.text) // self.charsperview
+        return 1
+
+    def put(self, index, view):
+        self.discard(index)
+        cost = self._viewcost(view)
+        if cost > self.size:
+            return
+        self._views[index] = view
+        self._cost += cost
+        while self._cost > self.size:
+            self.discard(next(iter(self._views)))
+
+    def get(self, index, title, wiki=None):
+        """Return the view at index if it shows title, else None.
+
+        If wiki is given, the view must also be of that wiki.
+        """
+        view = self._views.get(index)
+        if (view is None or view.title != title or
+                wiki is not None and view.wiki is not wiki):
+            return None
+        self._views.move_to_end(index)
+        return view
+
+    def discard(self, index):
+        view = self._views.pop(index, None)
+        if view is not None:
+            self._cost -= self._viewcost(view)
+
+    def truncate(self, length):
+        """Drop the views at positions from length on."""
+        for i in [i for i in self._views if i >= length]:
+            self.discard(i)
+
+    def forget(self, title):
+        """Drop the views of title, such as after it is edited."""
+        for i in [i for i, view in self._views.items() if view.title == title]:
+            self.discard(i)
+
+
 class StandardKeyBinds:
+    _rowcounts = None
+
+    def rowOffsets(self, maxcol):
+        """Return the first row of each widget, followed by the total rows.
+
+        Widgets of a LazyWalker are not created for this; the rows of those
+        not yet displayed are estimated with estimateRows(). The rows of the
+        others are cached until the width changes, or _rowcounts is reset to
+        None when the content changes.
+        """
+        if self._rowcounts is None or self._rowcounts[0] != maxcol:
+            self._rowcounts = (maxcol, {})
+        counts = self._rowcounts[1]
+        lazy = isinstance(self.body, LazyWalker)
+        offsets = [0]
+        for position in range(len(self.body)):
+            rows = counts.get(position)
+            if rows is None:
+                widget = (self.body.widgets[position] if lazy
+                          else self.body[position])
+                if widget is None:
+                    rows = self.estimateRows(position, maxcol)
+                else:
+                    rows = counts[position] = widget.rows((maxcol,))
+            offsets.append(offsets[-1] + rows)
+        return offsets
+
+    def estimateRows(self, position, maxcol):
+        """Return the likely rows of a widget that is not created yet."""
+        counts = self._rowcounts[1]
+        return sum(counts.values()) / len(counts) if counts else 1
 
     def keypress(self, size, key):
         returnval = None
@@ -272,17 +492,24 @@ class StandardKeyBinds:
             self.change_focus(size, len(self.body) - 1)
             offset = maxrow - self.focus.rows((maxcol,))
             self.change_focus(size, len(self.body) - 1, offset)
+        elif key in ('n', 'N') and isinstance(self, Pager):
+            self.nextMatch(size, key == 'N')
         elif key in cmdmap and cmdmap[key]:
             processCmd(cmdmap[key])
         else:
             returnval = super().keypress(size, key)
 
+        if mainwidget.body is not self:
+            return returnval  # Another page was opened
+
         # Set progress percentage
-        lens = [i.rows((maxcol,)) for i in self.body]
+        offsets = self.rowOffsets(maxcol)
         offset, inset = self.get_focus_offset_inset(size)
         # Number of the first line on the screen
-        current_line = sum(lens[:self.body.focus]) - offset + inset
-        position = current_line / (sum(lens) - maxrow) * 100
+        current_line = offsets[self.body.focus] - offset + inset
+        position = current_line / (offsets[-1] - maxrow) * 100
+        # Rows may be estimated, so keep it in range
+        position = min(max(position, 0), 100)
         progress.set_text(str(round(position)) + '%')
 
         return returnval
@@ -315,6 +542,55 @@ class Disambig(StandardKeyBinds, SelectorBox):
         openPage(name)
 
 
+class Diff(urwid.ListBox):
+    """The changes of an edit, as a unified diff; esc returns to the edit."""
+    title = "Changes"
+
+    def __init__(self, text, newtext, back):
+        self.back = back
+        lines = difflib.unified_diff(text.splitlines(), newtext.splitlines(),
+                                     lineterm='')
+        super().__init__(urwid.SimpleListWalker(
+            [urwid.Text(i) for i in list(lines)[2:]]))
+
+    def keypress(self, size, key):
+        if key in ('esc', 'q'):
+            self.back()
+        else:
+            return super().keypress(size, key)
+
+
+class Statistics(urwid.ListBox):
+    """Times of the stages of opening pages, and counts of cache use."""
+    title = "Statistics"
+
+    def __init__(self):
+        addPalette(formats.h)
+        lines = [(formats.h, '%-16s %8s %12s %12s' %
+                  ('Stage', 'Count', 'Total (ms)', 'Mean (ms)'))]
+        for stage in sorted(stats.times, key=lambda i: (
+                stages.index(i) if i in stages else len(stages), i)):
+            count, total = stats.times[stage]
+            lines.append('%-16s %8d %12.1f %12.1f' %
+                         (stage, count, total * 1000, total * 1000 / count))
+        lines += ['', (formats.h, 'Counts')]
+        lines += ['%-24s %12d' % i for i in sorted(stats.counts.items())]
+        lines += ['', (formats.h, 'Recent pages (ms)')]
+        for trace in reversed(stats.traces):
+            times = ', '.join('%s %.1f' % (stage, trace.times[stage] * 1000)
+                              for stage in stages if stage in trace.times)
+            lines.append('%s: %.1f (%s)' % (trace.title, trace.total * 1000,
+                                            times))
+        super().__init__(urwid.SimpleListWalker(
+            [urwid.Text(i) for i in lines]))
+
+    def keypress(self, size, key):
+        if key in ('esc', 'q'):
+            closeOverlay()
+        else:
+            return super().keypress(size, key)
+
+
 class Results(StandardKeyBinds, SelectorBox):
     widgetnames = []
 
@@ -329,116 +605,441 @@ class Results(StandardKeyBinds, SelectorBox):
         openPage(title)
 
 
+class LazyWalker(urwid.ListWalker):
+    """List walker creating widgets with factory(position) when displayed."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.widgets = []
+        self.focus = 0
+
+    def reset(self, length):
+        """Discard all widgets, keeping the focus if possible."""
+        self.widgets = [None] * length
+        self.focus = min(self.focus, max(length - 1, 0))
+        self._modified()
+
+    def __len__(self):
+        return len(self.widgets)
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self.widgets):
+            raise IndexError(position)
+        widget = self.widgets[position]
+        if widget is None:
+            widget = self.widgets[position] = self.factory(position)
+        return widget
+
+    def next_position(self, position):
+        if position + 1 >= len(self.widgets):
+            raise IndexError(position)
+        return position + 1
+
+    def prev_position(self, position):
+        if position <= 0:
+            raise IndexError(position)
+        return position - 1
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def invalidate(self, positions):
+        """Recreate the widgets at positions when they are next displayed."""
+        for i in positions:
+            self.widgets[i] = None
+        self._modified()
+
+    def positions(self, reverse=False):
+        if reverse:
+            return range(len(self.widgets) - 1, -1, -1)
+        return range(len(self.widgets))
+
+
 class Pager(StandardKeyBinds, urwid.ListBox):
 
-    def __init__(self, page):
-        super().__init__(urwid.SimpleFocusListWalker([]))
-        self._content = page.content.copy()
-        self._render()
+    def __init__(self, page, trace=None):
+        super().__init__(LazyWalker(self._widget))
+        self._content = page.content
+        self._query = ''
+        self._occurrences = None
+        self._matches = {}
+        self._matchlist = []
+        self._matchindex = None
+        self._trace = trace
+        with stats.timed('render'):
+            self._render()
+
+    def render(self, size, focus=False):
+        if self._trace is None:
+            return super().render(size, focus)
+        # The page is opened once it is first drawn
+        with self._trace, stats.timed('draw'):
+            canvas = super().render(size, focus)
+        stats.finish(self._trace)
+        self._trace = None
+        return canvas
 
     def _render(self):
-        self.body.clear()
+        """Split the content into chunks, one for each widget.
+
+        Chunks are (start, end, align, padding, border), where start and end
+        are indices in the content. The widgets themselves are only created
+        when displayed.
+        """
         self.widgetnames = [(page.title, 0)]
-        curtext = [(0, '')]
+        self._chunks = []
+        start = -1  # The first widget begins with an empty string
         curh2 = ''
         prevalign = 'left'
         prevpadding = 0
         prevborder = False
-        for tformat, text in self._content:
-            align = settings.getColor(tformat, 'align', default='left')
-            padding = settings.getColor(tformat, 'padding', default=0)
-            border = settings.getColor(tformat, 'border', default=False)
+        for n, tformat in enumerate(self._content.formats):
+            if tformat not in palette:
+                addPalette(tformat)
+                addPalette(tformat | formats.searchresult)
+            attribute = settings.getAttribute(tformat)
+            align = attribute.align or 'left'
+            padding = attribute.padding
+            border = attribute.border
 
             if (((align, padding, border) != (prevalign, prevpadding, prevborder)
-                    and curtext) or (tformat & formats.h2 and not curh2)):
+                    and n > start) or (tformat & formats.h2 and not curh2)):
                 # Also have new Text() for every h2 for TOC
-                widget = urwid.Text(curtext, align=prevalign)
-                if prevborder:
-                    widget = urwid.LineBox(widget)
-                if prevpadding:
-                    widget = urwid.Padding(widget,
-                        left=prevpadding, right=prevpadding)
-                self.body.append(widget)
-                curtext.clear()
-            
-            curtext.append((tformat, text))
-
-            if tformat & formats.h2: 
-                curh2 += text
+                self._chunks.append(
+                    (start, n, prevalign, prevpadding, prevborder))
+                start = n
+
+            if tformat & formats.h2:
+                curh2 += self._content[n][1]
             elif curh2:
-                self.widgetnames.append((curh2, len(self.body) - 1))
+                self.widgetnames.append((curh2, len(self._chunks) - 1))
                 curh2 = ''
 
             prevalign = align
             prevpadding = padding
             prevborder = border
-        if curtext:
-            widget = urwid.Text(curtext, align=prevalign)
-            if prevborder:
-                widget = urwid.LineBox(widget)
-            if prevpadding:
-                widget = urwid.Padding(widget,
-                    left=prevpadding, right=prevpadding)
-            self.body.append(widget)
-
-    def _add(self, text, attribute):
-        if text:
-            if self._content and self._content[-1][0] == attribute:
-                self._content[-1][1] += text
-            else:
-                self._content.append([attribute, text])
+        if len(self._content) > start:
+            self._chunks.append((start, len(self._content),
+                                 prevalign, prevpadding, prevborder))
+        self._chunkstarts = [max(i[0], 0) for i in self._chunks]
+        self._rowcounts = None
+        self.body.reset(len(self._chunks))
+
+    def estimateRows(self, position, maxcol):
+        if isinstance(self._content, LazyContent):
+            # Its text is only converted when displayed
+            return super().estimateRows(position, maxcol)
+        start, end, align, padding, border = self._chunks[position]
+        start = self._content.start(max(start, 0))
+        end = self._content.start(end)
+        width = max(maxcol - 2 * padding - 2 * border, 1)
+        lines = self._content.text.count('\n', start, end) + 1
+        return lines + (end - start) // width + 2 * border
+
+    def headings(self):
+        """Return the h2 headings, in order."""
+        return [name.strip() for name, position in self.widgetnames[1:]]
+
+    def section(self):
+        """Return the index in headings() of the section in view, or None."""
+        n = None
+        for i, (widgetname, position) in enumerate(self.widgetnames[1:]):
+            if position > self.body.focus:
+                break
+            n = i
+        return n
+
+    def _chunkof(self, index):
+        """Return the position of the chunk containing content[index]."""
+        return bisect.bisect_right(self._chunkstarts, index) - 1
+
+    def _widget(self, position):
+        start, end, align, padding, border = self._chunks[position]
+        curtext = [(0, '')] if start < 0 else []
+        for n in range(max(start, 0), end):
+            tformat, text = self._content[n]
+            cur = 0
+            for mstart, mend in self._matches.get(n, ()):
+                curtext.append((tformat, text[cur:mstart]))
+                curtext.append((tformat | formats.searchresult,
+                                text[mstart:mend]))
+                cur = mend
+            curtext.append((tformat, text[cur:]))
+        widget = urwid.Text(curtext, align=align)
+        if border:
+            widget = urwid.LineBox(widget)
+        if padding:
+            widget = urwid.Padding(widget, left=padding, right=padding)
+        return widget
+
+    def _find(self, findtext):
+        """Return list of offsets in the text of occurrences of findtext.
+
+        Occurrences may overlap. When findtext extends the previous query,
+        only the occurrences of that query are checked.
+        """
+        text = self._content.text
+        if self._occurrences is not None and findtext.startswith(self._query):
+            return [i for i in self._occurrences
+                    if text.startswith(findtext, i)]
+        found = []
+        i = text.find(findtext)
+        while i != -1:
+            found.append(i)
+            i = text.find(findtext, i + 1)
+        return found
 
     def search(self, findtext):
-        self._content.clear()
-        for attribute, text in page.content:
-            cur = 0
-            for match in re.finditer(findtext, text):
-                start, end = match.start(), match.end()
-                self._add(text[cur:start], attribute)
-                self._add(text[start:end], attribute | formats.searchresult)
-                cur = end
-            if text[cur:]:
-                self._add(text[cur:], attribute)
-        self._render()
+        """Highlight the matches of the regular expression findtext."""
+        spans = []
+        if not findtext:
+            self._occurrences = None
+        elif re.escape(findtext) == findtext:
+            # Plain text, which can be searched incrementally
+            self._occurrences = self._find(findtext)
+            end = 0
+            for i in self._occurrences:
+                if i >= end:
+                    end = i + len(findtext)
+                    spans.append((i, end))
+        else:
+            self._occurrences = None
+            try:
+                pattern = re.compile(findtext, re.M)
+            except re.error:
+                pattern = None  # Incomplete expression, while typing
+            if pattern:
+                spans = [i.span() for i in pattern.finditer(self._content.text)
+                         if i.end() > i.start()]
+        self._query = findtext
+        self._highlight(spans)
 
     def unsearch(self):
-        self._content = page.content.copy()
-        self._render()
-
+        self._query = ''
+        self._occurrences = None
+        self._highlight([])
+
+    def _highlight(self, spans):
+        """Set the matches to spans of the text.
+
+        Matches are split at the runs of the content they cross, and only the
+        widgets whose matches changed are recreated.
+        """
+        starts = self._content.starts.tolist() + [len(self._content.text)]
+        matches = {}
+        n = 0
+        for start, end in spans:
+            # Spans are in order, so the runs are found by moving forward
+            while starts[n + 1] <= start:
+                n += 1
+            if end <= starts[n + 1]:  # Within one run, as most are
+                matches.setdefault(n, []).append((start - starts[n],
+                                                  end - starts[n]))
+                continue
+            run = n
+            while starts[run] < end:
+                runstart = starts[run]
+                matches.setdefault(run, []).append(
+                    (max(start, runstart) - runstart,
+                     min(end, starts[run + 1]) - runstart))
+                run += 1
+        changed = {self._chunkof(n) for n in matches.keys() | self._matches.keys()
+                   if matches.get(n) != self._matches.get(n)}
+        self._matches = matches
+        self._matchlist = [start for start, end in spans]
+        self._matchindex = None
+        if changed:
+            self.body.invalidate(changed)
+
+    def nextMatch(self, size, reverse=False):
+        """Scroll to the next match of the search, or previous if reverse."""
+        if not self._matchlist:
+            if self._query:
+                ex.notify('Pattern not found: ' + self._query)
+            return
+        if self._matchindex is not None:
+            step = -1 if reverse else 1
+            self._matchindex = (self._matchindex + step) % len(self._matchlist)
+        else:
+            # Start from the widget in focus
+            focus = self.body.focus
+            if reverse:
+                end = self._content.start(self._chunks[focus][1])
+                index = bisect.bisect_left(self._matchlist, end) - 1
+            else:
+                start = self._content.start(self._chunkstarts[focus])
+                index = bisect.bisect_left(self._matchlist, start)
+            self._matchindex = index % len(self._matchlist)
 
-def openPage(title=None, featured=False, browsinghistory=False):
-    if not title:
-        title = wiki.mainpage
+        offset = self._matchlist[self._matchindex]
+        position = self._chunkof(self._content.run(offset))
+        maxcol, maxrow = size
+        chunkstart, chunkend, align, padding, border = self._chunks[position]
+        # Find the row of the match in the widget
+        offset -= self._content.start(max(chunkstart, 0))
+        textwidget = self.body[position]
+        while not isinstance(textwidget, urwid.Text):
+            textwidget = textwidget.original_widget
+        width = maxcol - 2 * padding - (2 if border else 0)
+        layout = textwidget.get_line_translation(width)
+        x, row = urwid.text_layout.calc_coords(textwidget.text, layout, offset)
+        if border:
+            row += 1
+        self.change_focus(size, position, maxrow // 3 - row)
+
+
+def openPage(title=None, featured=False, index=None):
+    """Open a page, after the current one in the history.
+
+    If index is given, the page at that position of the history is opened
+    instead, showing the view left there if it is kept.
+    """
+    global current
+    saveView()
 
-    if not browsinghistory:
-        global current
+    if index is None:
         if current < len(history)-1:
             del history[current+1:len(history)]
+            views.truncate(current + 1)
         history.append(title)
         current += 1
-
-    global page
-    if featured:
-        page = wiki.get_featured_feed(title)
     else:
-        page = wiki.search(title)
-    # This is not as inefficient as it looks; Wiki caches results
-    if not page.exists and wiki.search_sugestions(page.title):
+        current = index
+        view = views.get(current, title, wiki)
+        stats.hit('views', view is not None)
+        if view is not None:
+            showView(view)
+            return
+
+    currentwiki = wiki
+    trace = Trace(title, wiki.siteurl)
+    def fetch():
+        with trace:
+            name = trace.title = title or currentwiki.mainpage
+            if featured:
+                result = currentwiki.get_featured_feed(name)
+            else:
+                result = currentwiki.search(name)
+            # This is not as inefficient as it looks; Wiki caches results
+            sugestions = None
+            if not result.exists:
+                sugestions = currentwiki.search_sugestions(result.title)
+        return name, result, sugestions, featured, trace
+
+    mainwidget.body = loading
+    loader.start(fetch, showPage, loadFailed)
+
+
+def openPageUrl(url, title):
+    """Open a page of the wiki a page url belongs to.
+
+    The wiki is looked up in the background, since finding its api may take
+    several requests.
+    """
+    saveView()
+
+    def found(newwiki):
+        if newwiki is None:
+            restoreView()
+            ex.notify('Error: The api of the wiki was not found')
+            return
+        # The view saved above is restored if opening the page fails
+        openWiki(newwiki)
+        openPage(title)
+
+    currentwiki = wiki
+    mainwidget.body = loading
+    loader.start(lambda: Wiki.fromPageUrl(url, currentwiki), found,
+                 loadFailed)
+
+
+def showPage(result):
+    global page, previousview
+    previousview = None
+    title, page, sugestions, featured, trace = result
+    stale = ' [offline]' if page.stale else ''
+    if not page.exists and sugestions:
         header.set_text('Results for ' + title)
-        mainwidget.body = Results(wiki.search_sugestions(page.title))
+        mainwidget.body = Results(sugestions)
+        stats.finish(trace)
     elif 'disambiguation' in page.properties:
-        header.set_text(page.title + ': Disambiguation')
+        header.set_text(page.title + ': Disambiguation' + stale)
         mainwidget.body = Disambig(page.html)
+        stats.finish(trace)
     else:
-        header.set_text(page.title)
-        mainwidget.body = Pager(page)
+        header.set_text(page.title + stale)
+        with trace:
+            mainwidget.body = Pager(page, trace)
+        if not featured:
+            wiki.prefetch(page.links[:settings.prefetch_depth])
 
     setTerminalWindowTitle(title)
     progress.set_text('0%')
+    views.put(current, View(history[current], wiki, mainwidget.body,
+                            header.text, page, '0%'))
+
+
+def leaveView():
+    """Remember the scroll position shown for the current view."""
+    view = views.get(current, history[current] if history else None)
+    if view is not None and view.body is mainwidget.body:
+        views.put(current, view._replace(progress=progress.text))
+
+
+def showView(view):
+    """Show a page of the history again, as it was left."""
+    global page, previousview
+    loader.cancel()
+    previousview = None
+    page = view.page
+    header.set_text(view.header)
+    mainwidget.body = view.body
+    setTerminalWindowTitle(view.title or wiki.mainpage)
+    progress.set_text(view.progress)
+
+
+def saveView():
+    """Remember the view shown, to return to if opening a page fails.
+
+    Nothing is saved while a page is being opened, so that it is the view
+    shown before that is returned to.
+    """
+    global previousview
+    if previousview is None:
+        previousview = (wiki, mainwidget.body, header.text, history.copy(),
+                        current)
+        leaveView()
+
+
+def restoreView():
+    global current, previousview
+    oldwiki, body, headertext, history[:], current = previousview
+    previousview = None
+    if oldwiki is not wiki:
+        openWiki(oldwiki)
+    mainwidget.body = body
+    header.set_text(headertext)
+    progress.set_text('')
+
+
+def loadFailed(error):
+    restoreView()
+    ex.notify('Error: ' + str(error))
+
+
+def cancelLoad():
+    if loader.active is not None:
+        loader.cancel()
+        restoreView()
+        ex.notify('Loading Canceled')
 
 
 def openWiki(name):
     global wiki
+    if wiki:
+        wiki.cancel_prefetch()
+        wiki.titles.save()
     if isinstance(name, Wiki):
         wiki = name
         return
@@ -459,9 +1060,9 @@ def runEditor(text):
         return file.read()
 
 
-def edit(title):
+def edit(title, section=None, name=None):
     try:
-        text, verify = wiki.init_edit(title)
+        text, verify = wiki.init_edit(title, section, name)
         wiki.login()
 
         newtext = runEditor(text)
@@ -473,14 +1074,22 @@ def edit(title):
             closeOverlay()
             wiki.commit_edit(newtext, summary.edit_text,
                              minor.get_state(), verify)
+            views.forget(title)
+            views.discard(current)  # Also if opened by another name
             openPage(title)
         def cancel(button):
             closeOverlay()
+        def showdiff(button):
+            openOverlay(Diff(text, newtext,
+                             lambda: openOverlay(pile, 'Edit', 'pack')),
+                        height=('relative', 80), width=('relative', 80))
         summary = urwid.Edit('Summary: ')
         minor = urwid.CheckBox('Minor Edit')
+        diff_button = urwid.Button('Show Changes', showdiff)
         cancel_button = urwid.Button('Cancel', cancel)
         submit_button = urwid.Button('Submit', submit)
-        pile = urwid.Pile([summary, minor, cancel_button, submit_button])
+        pile = urwid.Pile([summary, minor, diff_button, cancel_button,
+                           submit_button])
         openOverlay(pile, 'Edit', 'pack')
     except WikiError as e:
         ex.notify('Error: ' + str(e))
@@ -494,18 +1103,21 @@ overlaymap = {'bmarks': Bmarks,
               'extlinks': Extlinks,
               'langs': Langs}
 cmds = tuple(overlaymap) + ('quit', 'bmark', 'open', 'edit', 'clearcache',
-                            'help', 'back', 'forward', 'random')
+                            'help', 'back', 'forward', 'random', 'save',
+                            'sync', 'stats')
 
 def processCmd(cmd, *args):
-    global current
 
     if cmd in ('q', 'quit'):
         raise urwid.ExitMainLoop
     elif cmd == 'bmark':
-        wiki.bmarks.add(page.title)
+        wiki.bmarks.add(page.title, ' '.join(args) if args else None)
         ex.notify("Bookmark Added")
     elif cmd in overlaymap:
-        openOverlay(overlaymap[cmd]())
+        try:
+            openOverlay(overlaymap[cmd]())
+        except WikiError as e:
+            ex.notify('Error: ' + str(e))
     elif cmd == 'open':
         if args:
             openPage(' '.join(args))
@@ -513,20 +1125,48 @@ def processCmd(cmd, *args):
             openOverlay(SearchBox())
     elif cmd == 'clearcache':
         wiki.clear_cache()
+    elif cmd == 'stats':
+        openOverlay(Statistics(), height=('relative', 80),
+                    width=('relative', 80))
     elif cmd == 'edit':
-        edit(page.title)
+        # Only the section in view, if any
+        section = None
+        if isinstance(mainwidget.body, Pager):
+            n = mainwidget.body.section()
+            if n is not None:
+                section = page.section(mainwidget.body.headings(), n)
+        edit(page.title, section, history[current] or wiki.mainpage)
     elif cmd == 'help':
         executeCommand(['man', 'wikicurses'])
     elif cmd == 'back':
         if current > 0:
-            current -= 1
-            openPage(history[current], browsinghistory=True)
+            openPage(history[current-1], index=current-1)
     elif cmd == 'forward':
         if current < len(history)-1:
-            current += 1
-            openPage(history[current], browsinghistory=True)
+            openPage(history[current+1], index=current+1)
     elif cmd == 'random':
-        openPage(wiki.random())
+        try:
+            openPage(wiki.random())
+        except WikiError as e:
+            ex.notify('Error: ' + str(e))
+    elif cmd == 'save':
+        if not (page.exists and page.article):
+            ex.notify("Only articles can be saved")
+            return
+        name = history[current]
+        currentwiki = wiki
+        syncloader.start(lambda: currentwiki.sync([name or
+                                                   currentwiki.mainpage]),
+                         lambda saved: ex.notify("Page Saved" if saved else
+                                                 "Page Not Saved"),
+                         lambda error: ex.notify('Error: ' + str(error)))
+    elif cmd == 'sync':
+        names = list(wiki.bmarks)
+        currentwiki = wiki
+        syncloader.start(lambda: currentwiki.sync(names),
+                         lambda saved: ex.notify("Saved %d of %d bookmarks"
+                                                 % (saved, len(names))),
+                         lambda error: ex.notify('Error: ' + str(error)))
     elif cmd:
         ex.notify(cmd + ': Unknown Command')
 
@@ -543,6 +1183,18 @@ def closeOverlay():
     loop.widget = mainwidget
 
 
+def addPalette(tformat):
+    """Register the display attributes for tformat, if not already done."""
+    if tformat not in palette:
+        attribute = settings.getAttribute(tformat)
+        fg = attribute.settings.copy()
+        if attribute.fgcolor:
+            fg.append(attribute.fgcolor)
+        loop.screen.register_palette_entry(tformat, ','.join(fg),
+                                           attribute.bgcolor)
+        palette.add(tformat)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="A simple curses interface for accessing Wikipedia.")
@@ -560,23 +1212,37 @@ def main():
                         help="print default color settings")
 
     parser.add_argument('-f', '--feed', help='view featured feed')
+    parser.add_argument('-o', '--offline', action='store_true',
+                        help="only show pages saved for offline reading")
+    parser.add_argument('--dump', metavar='FILE',
+                        help="write the pages listed in FILE to text files")
+    parser.add_argument('--out', metavar='DIR', default='.',
+                        help="directory to write pages to with --dump")
+    parser.add_argument('--ansi', action='store_true',
+                        help="use colors in pages written with --dump")
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help="parallel downloads and parsers with --dump")
 
     args = parser.parse_args()
-    openWiki(args.wiki)
 
     if args.complete:
-        if args.complete == 'search':
-            sugestions = wiki.search_sugestions(args.search)
-        elif args.complete == 'feed':
-            sugestions = wiki.list_featured_feeds()
-        elif args.complete == 'wiki':
-            sugestions = settings.wikis().keys()
-        print(*sugestions, sep='\n')
+        print(*complete(args.complete, args.search or '', args.wiki),
+              sep='\n')
         return
-    elif args.dumpcolors:
+
+    if args.offline:
+        settings.offline = True
+    openWiki(args.wiki)
+    if args.dumpcolors:
         settings.dumpColors()
         print("Color settings written to " + settings.colorspath + '.')
         return
+    elif args.dump:
+        with open(args.dump) as file:
+            titles = list(dict.fromkeys(i.strip() for i in file if i.strip()))
+        if dump(wiki, titles, args.out, args.ansi, max(args.jobs, 1)):
+            sys.exit(1)
+        return
 
     callback = lambda x, y: openPage(args.feed or args.search, bool(args.feed))
     loop.set_alarm_in(.001, callback)  # Open page once loop is started
@@ -584,22 +1250,18 @@ def main():
         loop.run()
     except KeyboardInterrupt:
         pass
+    stop_prefetching()
+    wiki.titles.save()
 
 
 history = []
 current = -1
+wiki = None
 page = None
+previousview = None
+views = Views(settings.history_views)
 
-palette = []
-for x in range(1, sum(formats) + 1):
-    fgcolor = settings.getColor(x, 'fgcolor')
-    bg = settings.getColor(x, 'bgcolor')
-    fgfmts = {j for i in formats if x & i and i.name in settings.colors
-            for j in settings.colors[i.name][0]}
-    if fgcolor:
-        fgfmts.add(fgcolor)
-    fg = ','.join(fgfmts)
-    palette.append((x, fg, bg))
+palette = set()
 
 urwid.command_map['k'] = 'cursor up'
 urwid.command_map['j'] = 'cursor down'
@@ -608,8 +1270,12 @@ urwid.command_map['ctrl f'] = 'cursor page down'
 
 ex = Ex()
 header = urwid.Text('Wikicurses', align='center')
-loading = urwid.Filler(urwid.Text('Loading...'), 'top')
+loading = Loading(urwid.Text('Loading...'), 'top')
 progress = urwid.Text('')
 footer = urwid.Columns([ex, ('pack', progress)], 2)
 mainwidget = urwid.Frame(loading, urwid.AttrMap(header, formats.h1), footer)
-loop = urwid.MainLoop(mainwidget, palette=palette, handle_mouse=settings.mouse)
+loop = urwid.MainLoop(mainwidget, handle_mouse=settings.mouse)
+addPalette(formats.h1)
+loader = Loader()
+sugestionloader = Loader(spinner='')
+syncloader = Loader(spinner='')
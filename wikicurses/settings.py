@@ -1,5 +1,4 @@
 import os
-import json
 import collections
 import configparser
 from wikicurses import formats
@@ -20,6 +19,38 @@ try:
     hide_references = conf.getboolean('general', 'hide_references')
 except (ValueError, configparser.NoOptionError, configparser.NoSectionError):
     hide_references = False
+try:
+    cache_size = conf.getint('general', 'cache_size')
+except (ValueError, configparser.NoOptionError, configparser.NoSectionError):
+    cache_size = 50
+try:
+    timeout = conf.getfloat('general', 'timeout')
+except (ValueError, configparser.NoOptionError, configparser.NoSectionError):
+    timeout = 30
+try:
+    prefetch_depth = conf.getint('general', 'prefetch_depth')
+except (ValueError, configparser.NoOptionError, configparser.NoSectionError):
+    prefetch_depth = 0
+try:
+    prefetch_workers = max(conf.getint('general', 'prefetch_workers'), 1)
+except (ValueError, configparser.NoOptionError, configparser.NoSectionError):
+    prefetch_workers = 2
+try:
+    history_views = conf.getint('general', 'history_views')
+except (ValueError, configparser.NoOptionError, configparser.NoSectionError):
+    history_views = 10
+try:
+    offline = conf.getboolean('general', 'offline')
+except (ValueError, configparser.NoOptionError, configparser.NoSectionError):
+    offline = False
+try:
+    parser = conf.get('general', 'parser')
+except (configparser.NoOptionError, configparser.NoSectionError):
+    parser = 'lxml'
+try:
+    trace_file = os.path.expanduser(conf.get('general', 'trace_file'))
+except (configparser.NoOptionError, configparser.NoSectionError):
+    trace_file = None
 
 Attribute = collections.namedtuple('Attribute',
         ('settings', 'fgcolor', 'bgcolor', 'align', 'padding', 'border'))
@@ -56,10 +87,32 @@ if os.path.exists(colorspath):
 else:
     colors = defcolors
 
+_attributes = [None] * (1 << len(formats))
+
+def getAttribute(tformat):
+    """Return the combined Attribute for a bitmask of formats.
+
+    Each combination is only computed the first time it is used.
+    """
+    attribute = _attributes[tformat]
+    if attribute is None:
+        attrs = [colors[i.name] for i in formats
+                 if tformat & i and i.name in colors]
+        settings = []
+        for i in attrs:
+            settings.extend(j for j in i.settings if j not in settings)
+        # For the other values, the last format setting one is used
+        values = []
+        for name, default in zip(Attribute._fields[1:],
+                                 ('', '', '', 0, False)):
+            given = [getattr(i, name) for i in attrs if getattr(i, name)]
+            values.append(given[-1] if given else default)
+        attribute = Attribute(settings, *values)
+        _attributes[tformat] = attribute
+    return attribute
+
 def getColor(tformat, name, default=''):
-    values = [j for j in (getattr(colors[i.name], name) for i in formats
-              if tformat & i and i.name in colors) if j]
-    return values[-1] if values else default
+    return getattr(getAttribute(tformat), name) or default
 
 def dumpColors():
     colorsconf = configparser.ConfigParser()
@@ -74,34 +127,10 @@ def dumpColors():
     with open(colorspath, 'w') as file:
         colorsconf.write(file)
 
-class Settings:
-
-    def __init__(self, wiki, name):
-        self.configpath = configpath + '/' + urlparse(wiki).netloc
-        self.file = self.configpath + '/' + name
-
-    def __iter__(self):
-        if not os.path.exists(self.file):
-            return iter(())
-        with open(self.file) as file:
-            yield from json.load(file)
-
-    def _save(self, bookmarks):
-        if not os.path.exists(self.configpath):
-            os.makedirs(self.configpath)
-        with open(self.file, 'w') as file:
-            json.dump(bookmarks, file)
-
-    def add(self, bmark):
-        bookmarks = set(self)
-        bookmarks.add(bmark)
-        self._save(list(bookmarks))
-
-    def discard(self, bmark):
-        bookmarks = set(self)
-        bookmarks.discard(bmark)
-        self._save(list(bookmarks))
-
+def wikiconfigpath(wiki):
+    """Return the configuration directory used for the wiki url or dump."""
+    url = urlparse(wiki)
+    return configpath + '/' + (url.netloc or os.path.basename(url.path))
 
 def wikis():
     """Return dictionary of wiki urls by name."""
@@ -0,0 +1,108 @@
+"""Timing of the stages of opening pages, and counts of cache use.
+
+Stages are timed with stats.timed(), and events such as cache hits counted
+with stats.count(). Both are added to the totals for the session, and to the
+Trace of the page being opened in the calling thread, if any.
+"""
+import json
+import time
+import threading
+import contextlib
+from collections import Counter, deque
+
+from wikicurses import settings
+
+# The stages of opening a page, in order
+stages = ('query', 'cache', 'json', 'parse', 'render', 'draw')
+
+_local = threading.local()
+
+
+class Trace:
+    """Times and counts of opening one page.
+
+    Using it as a context manager makes it the trace of the calling thread.
+    """
+
+    def __init__(self, title, wiki):
+        self.title = title
+        self.wiki = wiki
+        self.start = time.time()
+        self.total = None
+        self.times = {}
+        self.counts = Counter()
+        self._previous = []
+
+    def __enter__(self):
+        self._previous.append(getattr(_local, 'trace', None))
+        _local.trace = self
+        return self
+
+    def __exit__(self, *exc):
+        _local.trace = self._previous.pop()
+
+    def tojson(self):
+        """Return the trace as an object that can be encoded to json."""
+        return {'time': self.start, 'wiki': self.wiki, 'title': self.title,
+                'total': round(self.total, 6),
+                'stages': {k: round(v, 6) for k, v in self.times.items()},
+                'counts': self.counts}
+
+
+class Stats:
+    """Totals of the times and counts for the session.
+
+    Traces of the last recent page opens are kept, and written as lines of
+    json to the file at path, if given.
+    """
+    recent = 10
+
+    def __init__(self, path=None):
+        self.path = path
+        self.times = {}  # [count, seconds] by stage
+        self.counts = Counter()
+        self.traces = deque(maxlen=self.recent)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        """Context manager adding the time spent in it to stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            trace = getattr(_local, 'trace', None)
+            with self._lock:
+                total = self.times.setdefault(stage, [0, 0])
+                total[0] += 1
+                total[1] += elapsed
+                if trace is not None:
+                    trace.times[stage] = trace.times.get(stage, 0) + elapsed
+
+    def count(self, name, n=1):
+        """Add n to the counter name."""
+        trace = getattr(_local, 'trace', None)
+        with self._lock:
+            self.counts[name] += n
+            if trace is not None:
+                trace.counts[name] += n
+
+    def hit(self, cache, hit):
+        """Count a hit, or a miss, of the named cache."""
+        self.count(cache + (' hits' if hit else ' misses'))
+
+    def finish(self, trace):
+        """Record a trace once the page is displayed."""
+        trace.total = time.time() - trace.start
+        with self._lock:
+            self.traces.append(trace)
+        if self.path:
+            try:
+                with open(self.path, 'a') as file:
+                    file.write(json.dumps(trace.tojson()) + '\n')
+            except OSError:
+                pass  # Not worth interrupting reading for
+
+
+stats = Stats(settings.trace_file)
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import bisect
+import threading
+
+from wikicurses.cache import _dump
+
+
+def merge(*lists):
+    """Combine lists of suggestions, without duplicates."""
+    return list(dict.fromkeys(i for l in lists for i in l))
+
+
+class SuggestionCache:
+    """Search suggestions of a wiki, saved to a json file.
+
+    Results are kept for maxage seconds, and only the maxentries most recent
+    queries are stored.
+    """
+    maxentries = 1000
+    maxage = 7 * 24 * 60 * 60
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as file:
+                    self._entries = json.load(file)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, query):
+        """Return the cached suggestions for query, or None."""
+        with self._lock:
+            entry = self._load().get(query)
+        if entry is None or entry[0] < time.time() - self.maxage:
+            return None
+        return entry[1]
+
+    def put(self, query, suggestions):
+        """Store the suggestions for query."""
+        with self._lock:
+            entries = self._load()
+            entries.pop(query, None)
+            entries[query] = [time.time(), suggestions]
+            for i in list(entries)[:-self.maxentries]:
+                del entries[i]
+            _dump(entries, self.path)
+
+    def clear(self):
+        """Remove all cached suggestions."""
+        with self._lock:
+            self._entries = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class TitleIndex:
+    """Known page titles of a wiki, for completing titles without queries.
+
+    Titles are kept sorted by their casefolded form, so titles starting with
+    a prefix are found by bisection. Once there are more than maxtitles, the
+    least recently added are dropped. Changes are written to a json file by
+    save().
+    """
+    maxtitles = 50000
+
+    def __init__(self, path):
+        self.path = path
+        self._titles = None  # In order of last addition
+        self._keys = None
+        self._changed = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._titles is None:
+            try:
+                with open(self.path) as file:
+                    titles = json.load(file)
+            except (OSError, ValueError):
+                titles = []
+            self._titles = dict.fromkeys(titles)
+            self._keys = sorted((i.casefold(), i) for i in self._titles)
+
+    def update(self, titles):
+        """Add titles to the index."""
+        with self._lock:
+            self._load()
+            for title in titles:
+                if title in self._titles:
+                    del self._titles[title]
+                else:
+                    bisect.insort(self._keys, (title.casefold(), title))
+                self._titles[title] = None
+                self._changed = True
+            for title in list(self._titles)[:-self.maxtitles]:
+                del self._titles[title]
+                del self._keys[bisect.bisect_left(self._keys,
+                                                  (title.casefold(), title))]
+
+    def complete(self, prefix, limit=10):
+        """Return up to limit titles starting with prefix, ignoring case."""
+        key = prefix.casefold()
+        matches = []
+        with self._lock:
+            self._load()
+            i = bisect.bisect_left(self._keys, (key,))
+            while (i < len(self._keys) and len(matches) < limit and
+                    self._keys[i][0].startswith(key)):
+                matches.append(self._keys[i][1])
+                i += 1
+        return matches
+
+    def save(self):
+        """Write the index to disk, if it has changed."""
+        with self._lock:
+            if self._changed:
+                _dump(list(self._titles), self.path)
+                self._changed = False
+
+    def clear(self):
+        """Remove all titles."""
+        with self._lock:
+            self._titles = {}
+            self._keys = []
+            self._changed = False
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,162 @@
+import sys
+import zlib
+import base64
+import threading
+import collections
+import http.client
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from wikicurses import __version__
+from wikicurses.stats import stats
+
+useragent = "Wikicurses/%s (https://github.com/ids1024/wikicurses)"\
+            " Python-urllib/%d.%d" % (( __version__,) + sys.version_info[:2])
+
+Response = collections.namedtuple('Response',
+        ('url', 'status', 'headers', 'body'))
+
+# Errors from reusing a connection the server has already closed
+_staleerrors = (http.client.RemoteDisconnected, ConnectionResetError,
+                BrokenPipeError)
+
+
+def _decode(body, encoding):
+    if encoding == 'gzip':
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:  # Raw deflate stream without zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+class ConnectionPool:
+    """Pool of keep-alive HTTP connections, kept per host.
+
+    Cookies are handled with the given http.cookiejar.CookieJar. Errors are
+    reported with the same exceptions as urllib.request.urlopen(). Proxies
+    are used as by urllib, from the http_proxy, https_proxy and no_proxy
+    environment variables, with a CONNECT tunnel for https.
+    """
+    maxredirects = 5
+
+    def __init__(self, cookiejar, headers, timeout, proxies=None):
+        self.cookiejar = cookiejar
+        self.headers = headers
+        self.timeout = timeout
+        if proxies is None:
+            proxies = urllib.request.getproxies()
+        self.proxies = proxies
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _proxy(self, scheme, netloc):
+        """Return (host, headers) of the proxy for a host, or None."""
+        proxy = self.proxies.get(scheme)
+        if not proxy or urllib.request.proxy_bypass(netloc):
+            return None
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        parts = urllib.parse.urlsplit(proxy)
+        headers = {}
+        if parts.username is not None:
+            credentials = '%s:%s' % (urllib.parse.unquote(parts.username),
+                                     urllib.parse.unquote(parts.password or
+                                                          ''))
+            headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(
+                credentials.encode()).decode()
+        return parts.netloc.rpartition('@')[2], headers
+
+    def _connection(self, scheme, netloc, proxy):
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        host = proxy[0] if proxy else netloc
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, timeout=self.timeout)
+            if proxy:
+                conn.set_tunnel(netloc, headers=proxy[1])
+        else:
+            conn = http.client.HTTPConnection(host, timeout=self.timeout)
+        return conn, False
+
+    def _release(self, scheme, netloc, conn):
+        with self._lock:
+            self._idle.setdefault((scheme, netloc), []).append(conn)
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle.clear()
+
+    def request(self, url, data=None, headers={}):
+        """Make a GET, or POST if data is given, request and return Response.
+
+        Redirects are followed, and the body is decompressed.
+        """
+        for i in range(self.maxredirects + 1):
+            response = self._request(url, data, headers)
+            location = response.headers.get('Location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                url = urllib.parse.urljoin(url, location)
+                if response.status in (301, 302, 303):
+                    data = None
+                continue
+            if response.status >= 400:
+                raise urllib.error.HTTPError(url, response.status,
+                    http.client.responses.get(response.status, ''),
+                    response.headers, None)
+            return response
+        raise urllib.error.HTTPError(url, response.status,
+            'Too many redirects', response.headers, None)
+
+    def _request(self, url, data, headers, retry=True):
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        proxy = self._proxy(parts.scheme, parts.netloc)
+        if proxy and parts.scheme == 'http':
+            # Sent to the proxy, with the whole url
+            path = urllib.parse.urlunsplit(parts[:3] + (parts.query, ''))
+            headers = dict(headers, **proxy[1])
+        request = urllib.request.Request(url, data,
+                                         dict(self.headers, **headers))
+        self.cookiejar.add_cookie_header(request)
+        request.add_unredirected_header('Accept-Encoding', 'gzip, deflate')
+        if data is not None:
+            request.add_unredirected_header(
+                'Content-Type', 'application/x-www-form-urlencoded')
+
+        conn, reused = self._connection(parts.scheme, parts.netloc, proxy)
+        sent = False
+        try:
+            conn.request(request.get_method(), path, data,
+                         dict(request.header_items()))
+            sent = True
+            response = conn.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, OSError) as e:
+            conn.close()
+            # A POST the server may have received, such as an edit, is not
+            # sent again
+            if (reused and retry and isinstance(e, _staleerrors) and
+                    (data is None or not sent)):
+                return self._request(url, data, headers, False)
+            raise urllib.error.URLError(e)
+
+        stats.count('bytes received', len(body))
+        self.cookiejar.extract_cookies(response, request)
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(parts.scheme, parts.netloc, conn)
+        body = _decode(body, response.getheader('Content-Encoding'))
+        return Response(url, response.status, response.msg, body)
@@ -1,19 +1,30 @@
-import sys
+import re
 import time
+import html
 import hashlib
 import json
-import urllib.request
+import threading
+import urllib.parse
 import http.cookiejar
 from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from bs4 import BeautifulSoup
 
-from wikicurses.htmlparse import parseArticle, parseFeature
-from wikicurses.settings import Settings, wikis, conf
-from wikicurses import formats, __version__
-
-useragent = "Wikicurses/%s (https://github.com/ids1024/wikicurses)"\
-            " Python-urllib/%d.%d" % (( __version__,) + sys.version_info[:2])
+from wikicurses.htmlparse import parseArticle, parseFeature, parseFeed
+from wikicurses.content import Content, LazyContent
+from wikicurses.cache import (ArticleCache, SiteInfoCache, EndpointCache,
+                              FeedCache)
+from wikicurses.bookmarks import Bookmarks
+from wikicurses.transport import ConnectionPool, useragent
+from wikicurses.stats import stats
+from wikicurses.backend import openBackend
+from wikicurses.batch import InFlight, Batcher
+from wikicurses.suggest import SuggestionCache, TitleIndex, merge
+from wikicurses.settings import wikis, conf, wikiconfigpath
+from wikicurses import settings
+from wikicurses import formats
 
 
 class WikiError(Exception):
@@ -23,14 +34,32 @@ class WikiError(Exception):
 class Wiki(object):
     """A mediawiki wiki."""
     csrftoken = None
+    prefetchage = 60  # Seconds prefetched articles are used unchecked
     _articlepath = None
     _mainpage = None
 
     def __init__(self, url, username, password):
         self.siteurl = url
+        self.backend = openBackend(url, pool)
         self.username = username
         self.password = password
-        self.bmarks = Settings(url, 'bookmarks')
+        self.bmarks = Bookmarks(wikiconfigpath(url) + '/bookmarks.sqlite')
+        self.cache = ArticleCache(url, wikiconfigpath(url) + '/cache.sqlite',
+                                  settings.cache_size * 1024 * 1024)
+        self.sugestions = SuggestionCache(wikiconfigpath(url) +
+                                          '/suggestions.json')
+        self.titles = TitleIndex(wikiconfigpath(url) + '/titles.json')
+        self.siteinfo = SiteInfoCache(wikiconfigpath(url) + '/siteinfo.json')
+        self.feeds = FeedCache(wikiconfigpath(url) + '/feeds')
+        self._refreshedfeeds = set()
+        self.offline = settings.offline
+        self._prefetching = OrderedDict()
+        self._inflight = InFlight()
+        self._articles = OrderedDict()  # Recently searched, by name
+        # Prefetched and not yet searched, by name, with the time fetched
+        self._prefetched = OrderedDict()
+        self._articleslock = threading.Lock()
+        self._revids = Batcher(self._lastrevids)
 
     @classmethod
     def fromName(cls, name):
@@ -49,26 +78,66 @@ class Wiki(object):
         return cls(url, username, password)
 
     @classmethod
-    def fromPageUrl(cls, url):
-        html = urllib.request.urlopen(url).read().decode()
-        soup = BeautifulSoup(html, 'lxml')
-        link = soup.find('link', rel='EditURI')
-        if not link:
-            return None
-        rsdurl = urllib.parse.urljoin(url, link['href'])
-        rsd = urllib.request.urlopen(rsdurl).read().decode()
-        soup = BeautifulSoup(rsd, "xml")
-        apiurl = soup.find('api', {'name': 'MediaWiki'})['apiLink']
-        return cls.fromApiUrl(apiurl)
+    def fromPageUrl(cls, url, via=None):
+        """Return the wiki a page url belongs to, or None if not found.
+
+        The api url is looked up in the cache of known hosts, after adding
+        the interwiki map of the wiki via if it has not been. Otherwise it
+        is discovered, and cached.
+        """
+        netloc = urllib.parse.urlparse(url).netloc
+        apiurl = endpoints.get(netloc)
+        if apiurl is None and via and not endpoints.seeded(via.siteurl):
+            try:
+                via._seed_endpoints()
+            except (OSError, ValueError, WikiError):
+                pass  # Discovered instead
+            apiurl = endpoints.get(netloc)
+        general = None
+        if apiurl is None:
+            apiurl, general = _discover(url, via)
+            if apiurl is None:
+                return None
+            endpoints.update({netloc: apiurl})
+        wiki = cls.fromApiUrl(apiurl)
+        if general:
+            wiki.siteinfo.put(general)
+        return wiki
+
+    def _seed_endpoints(self):
+        """Add the hosts in the interwiki map of the wiki to the cache."""
+        result = json.loads(self._query(action="query", meta="siteinfo",
+                                        siprop="interwikimap",
+                                        format="json"))
+        apis = {urllib.parse.urlparse(i['url']).netloc: i['api']
+                for i in result.get('query', {}).get('interwikimap', ())
+                if i.get('api')}
+        endpoints.update(apis, self.siteurl)
 
     def _get_siteinfo(self):
-        result = self._query(action="query", meta="siteinfo",
-                             siprop="general", format="json")
-        query = json.loads(result)["query"]
-        self._articlepath = urllib.parse.urljoin(
-            query['general']['base'],
-            query['general']['articlepath'])
-        self._mainpage = query['general']['mainpage']
+        """Set articlepath and mainpage from the saved or queried siteinfo.
+
+        The saved siteinfo is used even if old when offline or the wiki
+        cannot be reached.
+        """
+        general = self.siteinfo.get(stale=self.offline)
+        stats.hit('siteinfo', general is not None)
+        if general is None and self.offline:
+            raise WikiError("Site information is not saved for offline "
+                            "reading")
+        elif general is None:
+            try:
+                result = self._query(action="query", meta="siteinfo",
+                                     siprop="general", format="json")
+                general = json.loads(result)["query"]["general"]
+                self.siteinfo.put(general)
+            except OSError:
+                general = self.siteinfo.get(stale=True)
+                if general is None:
+                    raise
+        self._articlepath = urllib.parse.urljoin(general['base'],
+                                                 general['articlepath'])
+        self._mainpage = general['mainpage']
 
     @property
     def articlepath(self):
@@ -83,15 +152,16 @@ class Wiki(object):
         return self._mainpage
 
     def _query(self, post=False, **kwargs):
+        if self.offline:
+            raise WikiError("Not available when offline")
         params = {k: v for k, v in kwargs.items() if v is not False}
-        data = urllib.parse.urlencode(params)
-        url = self.siteurl
-        if post:
-            data = data.encode()
-        if not post:
-            url += '?' + data
-            data = None
-        return urllib.request.urlopen(url, data).read().decode('utf-8')
+        with stats.timed('query'):
+            if post:
+                return self.backend.query(params, post)
+            # Threads making the same query at the same time share the
+            # response
+            return self._inflight.call(tuple(sorted(params.items())),
+                                       self.backend.query, params)
 
     def login(self):
         """Log in to wiki using stored credentials."""
@@ -116,21 +186,29 @@ class Wiki(object):
         self._query(action='logout', format='json')
         self.csrftoken = None
 
-    def init_edit(self, title):
-        """Initialize edit of page.
+    def init_edit(self, title, section=None, name=None):
+        """Initialize edit of page, or only of a section if given its index.
 
-        Return tuple (text, verify) where text is the text to be modified and
-        verify should be passed to commit_edit().
+        name is the name the page was opened with, if not title, such as for
+        a redirect, so its cached copy is dropped after the edit. Return
+        tuple (text, verify) where text is the text to be modified and verify
+        should be passed to commit_edit().
         """
+        if self.backend.readonly:
+            raise WikiError("This wiki is read-only")
+        if section is None:
+            section = False
         result = json.loads(self._query(action='query', prop='revisions',
                                         rvprop='timestamp|content',
-                                        titles=title, format='json'))['query']
+                                        rvsection=section, titles=title,
+                                        format='json'))['query']
         if "missing" in result:
             raise WikiError("Page Not Found")
 
         rev = next(iter(result['pages'].values()))['revisions'][0]
         starttime = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
-        return rev['*'], (title, rev['timestamp'], starttime)
+        return rev['*'], (title, rev['timestamp'], starttime, section,
+                          name or title)
 
     def commit_edit(self, text, summary, minor, verify):
         """Commit edit of page.
@@ -146,20 +224,181 @@ class Wiki(object):
                                         title=verify[0], basetimestamp=verify[1],
                                         starttimestamp=verify[2], md5=md5sum,
                                         token=self.csrftoken, summary=summary,
-                                        minor=minor, format='json'))['edit']
-        self.search.cache_clear()
+                                        minor=minor, section=verify[3],
+                                        format='json'))['edit']
+        for name in {verify[0], verify[4]}:
+            self._forget(name)
+            self.cache.discard(name)
         if result['result'] != 'Success':
             raise WikiError(result['result'])
 
-    @lru_cache(16)
+    def _lastrevid(self, name):
+        """Return the id of the latest revision of a page, or None.
+
+        Concurrent calls, such as those of prefetching, are combined into
+        one query.
+        """
+        return self._revids.get(name)
+
+    def _lastrevids(self, names):
+        """Return dict of the latest revision id of pages by name.
+
+        Pages are queried fifty at a time. The id is None for missing pages.
+        """
+        revids = {}
+        for i in range(0, len(names), 50):
+            batch = names[i:i + 50]
+            result = json.loads(self._query(action="query", prop="info",
+                                            titles='|'.join(batch),
+                                            format="json", redirects=True
+                                            ))["query"]
+            normalized = {i['from']: i['to']
+                          for i in result.get('normalized', ())}
+            redirects = {i['from']: i['to']
+                         for i in result.get('redirects', ())}
+            pages = {i['title']: i.get('lastrevid')
+                     for i in result.get('pages', {}).values()}
+            for name in batch:
+                title = normalized.get(name, name)
+                title = redirects.get(title, title)
+                revids[name] = pages.get(title)
+        return revids
+
+    def _parse(self, name):
+        """Return the result of action=parse for a page, or {} if missing."""
+        result = self._query(action="parse", page=name,
+                             prop="externallinks|iwlinks|langlinks|links|"
+                             "displaytitle|properties|sections|text",
+                             format="json", redirects=True)
+        with stats.timed('json'):
+            return json.loads(result).get('parse', {})
+
     def search(self, name):
-        """Search wiki for article and return _Article object."""
-        result = json.loads(self._query(action="parse", page=name,
-                                        prop="externallinks|iwlinks|langlinks|"
-                                        "links|displaytitle|properties|text",
-                                        format="json", redirects=True
-                                        )).get('parse', {})
-        return _Article(name, result)
+        """Search wiki for article and return _Article object.
+
+        When offline, or if the wiki cannot be reached, the article is read
+        from the cache and marked as stale.
+        """
+        if self.offline:
+            return self._stored(name)
+        try:
+            return self._search(name)
+        except OSError:
+            article = self._stored(name)
+            if not article.exists:
+                raise
+            return article
+
+    def _stored(self, name):
+        """Return the cached article for name, without querying the wiki."""
+        # Also try the title as the wiki would normalize it
+        for title in (name, name[:1].upper() + name[1:].replace('_', ' ')):
+            cached = self.cache.get(title)
+            if cached:
+                revid, result, content = cached
+                article = _Article(name, result, content)
+                article.stale = True
+                return article
+        article = _Article(name, {})
+        article.content = Content([(0, 'Page Not Found. It is not saved '
+                                       'for offline reading.')])
+        return article
+
+    def _search(self, name):
+        """Return _Article, reusing the last 16 articles searched for.
+
+        An article prefetched less than prefetchage seconds ago is used
+        without checking its revision.
+        """
+        with self._articleslock:
+            article = self._articles.get(name)
+            stats.hit('articles', article is not None)
+            if article is not None:
+                self._articles.move_to_end(name)
+                return article
+            fetched, article = self._prefetched.pop(name, (0, None))
+            if time.time() - fetched > self.prefetchage:
+                article = None
+            if settings.prefetch_depth:
+                stats.hit('prefetched', article is not None)
+        if article is None:
+            article = self._fetch(name)
+        with self._articleslock:
+            self._articles[name] = article
+            while len(self._articles) > 16:
+                self._articles.popitem(last=False)
+        return article
+
+    def _forget(self, title):
+        """Drop a page from the recently searched articles."""
+        with self._articleslock:
+            for name, article in list(self._articles.items()):
+                if title in (name, article.title):
+                    del self._articles[name]
+            for name, (fetched, article) in list(self._prefetched.items()):
+                if title in (name, article.title):
+                    del self._prefetched[name]
+
+    def _fetch(self, name):
+        """Return _Article, from the cache if its revision is current."""
+        with stats.timed('cache'):
+            cached = self.cache.get(name)
+        current = cached and cached[0] == self._lastrevid(name)
+        stats.hit('article cache', bool(current))
+        if current:
+            revid, result, content = cached
+            article = _Article(name, result, content)
+        else:
+            result = self._parse(name)
+            article = _Article(name, result)
+            if article.exists and 'revid' in result:
+                self.cache.put(name, result.get('revid'), result,
+                               article.content)
+        if article.exists:
+            self.titles.update([article.title] + article.links)
+        return article
+
+    def prefetch(self, titles):
+        """Fetch and parse articles in the background to fill the cache.
+
+        Does nothing unless prefetch_depth is set. Only the most recently
+        requested titles are kept queued. The articles are kept apart from
+        the recently searched articles, so they do not push those out.
+        """
+        global _prefetcher
+        if not settings.prefetch_depth or self.offline:
+            return
+        if _prefetcher is None:
+            _prefetcher = ThreadPoolExecutor(settings.prefetch_workers)
+        for title in titles:
+            if title not in self._prefetching:
+                self._prefetching[title] = _prefetcher.submit(
+                    self._prefetch, title)
+        maxqueued = settings.prefetch_depth + settings.prefetch_workers
+        for title, future in list(self._prefetching.items()):
+            if future.done():
+                del self._prefetching[title]
+            elif len(self._prefetching) > maxqueued and future.cancel():
+                del self._prefetching[title]
+
+    def _prefetch(self, name):
+        with self._articleslock:
+            if name in self._articles or name in self._prefetched:
+                return
+        article = self._fetch(name)
+        with self._articleslock:
+            self._prefetched[name] = (time.time(), article)
+            # About the links of the last two pages opened
+            maxkept = 2 * (settings.prefetch_depth +
+                           settings.prefetch_workers)
+            while len(self._prefetched) > maxkept:
+                self._prefetched.popitem(last=False)
+
+    def cancel_prefetch(self):
+        """Cancel all queued background fetches."""
+        for future in self._prefetching.values():
+            future.cancel()
+        self._prefetching.clear()
 
     @lru_cache(1)
     def list_featured_feeds(self):
@@ -172,16 +411,107 @@ class Wiki(object):
         return next(i for i in result["modules"][0]["parameters"]
                     if i["name"] == "feed")["type"]
 
-    @lru_cache(16)
     def get_featured_feed(self, feed):
-        result = self._query(action="featuredfeed", feed=feed)
-        return _Featured(BeautifulSoup(result, "xml").find("channel"))
+        """Return a featured feed as a page.
+
+        A saved copy is returned at once, and revalidated in the background
+        the first time it is used in a session. Otherwise the feed is
+        downloaded and saved.
+        """
+        saved = self.feeds.get(feed)
+        stats.hit('feeds', saved is not None)
+        if saved is None:
+            if self.offline:
+                raise WikiError("Feed is not saved for offline reading")
+            self._refreshedfeeds.add(feed)
+            return _Featured(self._fetch_feed(feed))
+        if not self.offline and feed not in self._refreshedfeeds:
+            self._refreshedfeeds.add(feed)
+            threading.Thread(target=self._refresh_feed, args=(feed, saved),
+                             daemon=True).start()
+        return _Featured(saved['feed'])
+
+    def _fetch_feed(self, feed, saved=None):
+        """Download and save a feed, unless the saved copy is current.
+
+        Return the feed as parsed by parseFeed().
+        """
+        if self.backend.readonly:
+            raise WikiError("Featured feeds are not available for this wiki")
+        headers = {}
+        if saved and saved['etag']:
+            headers['If-None-Match'] = saved['etag']
+        if saved and saved['modified']:
+            headers['If-Modified-Since'] = saved['modified']
+        with stats.timed('query'):
+            response = self.backend.fetch({'action': 'featuredfeed',
+                                           'feed': feed}, headers)
+        if response.status == 304:
+            return saved['feed']
+        try:
+            with stats.timed('parse'):
+                parsed = parseFeed(response.body)
+        except SyntaxError:  # Also ElementTree.ParseError
+            raise WikiError("Invalid featured feed: " + feed)
+        self.feeds.put(feed, parsed, response.headers.get('ETag'),
+                       response.headers.get('Last-Modified'))
+        return parsed
+
+    def _refresh_feed(self, feed, saved):
+        try:
+            self._fetch_feed(feed, saved)
+        except (OSError, WikiError):
+            pass  # The saved copy is kept
 
     @lru_cache(16)
     def search_sugestions(self, name):
         """Return list of search suggestions for specified string."""
-        result = self._query(action="opensearch", search=name, format="json")
-        return json.loads(result)[1]
+        if self.offline:
+            return self.local_sugestions(name)
+        sugestions = self.sugestions.get(name)
+        stats.hit('suggestions', sugestions is not None)
+        if sugestions is None:
+            result = self._query(action="opensearch", search=name,
+                                 format="json")
+            sugestions = json.loads(result)[1]
+            self.sugestions.put(name, sugestions)
+            self.titles.update(sugestions)
+        return sugestions
+
+    def local_sugestions(self, name):
+        """Return search suggestions known without querying the wiki.
+
+        These come from bookmarks, the index of titles seen and cached
+        suggestions.
+        """
+        return merge(self.sugestions.get(name) or (),
+                     self.bmarks.complete(name), self.titles.complete(name))
+
+    def sync(self, names):
+        """Save articles for offline reading, updating outdated copies.
+
+        Return the number of articles saved.
+        """
+        revids = self._lastrevids(names)
+        if self.siteinfo.get(stale=True) is None:
+            # Needed for the main page when offline
+            self._get_siteinfo()
+        saved = 0
+        for name in names:
+            cached = self.cache.get(name)
+            if revids[name] is None:
+                continue
+            elif cached and cached[0] == revids[name]:
+                self.cache.save(name)
+            else:
+                result = self._parse(name)
+                if not result:
+                    continue
+                self.cache.put(name, result.get('revid'), result,
+                               articleContent(result), saved=True)
+            saved += 1
+            self._forget(name)
+        return saved
 
     def random(self):
         """Return the name of a random page."""
@@ -191,63 +521,157 @@ class Wiki(object):
 
     def clear_cache(self):
         """Clear the cache."""
-        self.search.cache_clear()
+        with self._articleslock:
+            self._articles.clear()
+            self._prefetched.clear()
+        self.cache.clear()
+        self.sugestions.clear()
+        self.titles.clear()
+        self.siteinfo.clear()
         self.list_featured_feeds.cache_clear()
-        self.get_featured_feed.cache_clear()
+        self.feeds.clear()
         self.search_sugestions.cache_clear()
 
 
+# Namespaces of links not listed: project, template, template talk, category
+_hiddennamespaces = (4, 10, 11, 14)
+
+
 class _Page:
-    properties = {}
-    html = ''
-    links = []
-    iwlinks = []
-    extlinks = []
-    langlinks = {}
+    __slots__ = ('title', 'exists', 'stale', 'properties', 'html', 'links',
+                 'iwlinks', 'extlinks', 'langlinks', 'sections', 'content')
+    article = False
+
+    def __init__(self, title, exists, content):
+        self.title = title
+        self.exists = exists
+        self.content = content
+        self.stale = False
+        self.properties = {}
+        self.html = ''
+        self.links = []
+        self.iwlinks = []
+        self.extlinks = []
+        self.langlinks = {}
+        self.sections = []
+
+
+    def section(self, headings, n):
+        """Return the index for editing the nth of the h2 headings shown.
+
+        Headings may repeat, and sections may not be shown, so the section
+        is the one with the same heading and the same number of earlier
+        sections with that heading. Return None if not found.
+        """
+        name = headings[n]
+        occurrence = headings[:n].count(name)
+        indices = [index for heading, index in self.sections
+                   if heading == name]
+        return indices[occurrence] if occurrence < len(indices) else None
 
 
 class _Article(_Page):
-    content = [(0, 'Page Not Found.')]
+    __slots__ = ()
+    article = True
 
-    def __init__(self, search, result):
-        self.title = result.get('title', search)
-        self.exists = result != {}
+    def __init__(self, search, result, content=None):
+        super().__init__(result.get('title', search), result != {},
+                         Content([(0, 'Page Not Found.')]))
         if self.exists:
             self.properties = {i['name']: i['*'] for i in result.get('properties',())}
-            self.html = result['text']['*']
+            # Only needed for the disambiguation view
+            if 'disambiguation' in self.properties:
+                self.html = result['text']['*']
             self.links = [i['*'] for i in result['links'] if ('exists' in i) and
-                          not any(i['*'].startswith(j + ':') for j in
-                          ('Category', 'Template', 'Template talk', 'Wikipedia'))]
+                          i.get('ns') not in _hiddennamespaces]
             self.iwlinks = [(i['*'].split(':', 1)[1], i['url'])
                             for i in result['iwlinks']]
-            # if an url starts with //, it can by http or https.  Use http.
-            self.extlinks = ['http:' + i if i.startswith('//') else i
-                             for i in result['externallinks']]
+            self.extlinks = _extlinks(result)
             self.langlinks = {i.get('autonym', i['lang']): (i['url'], i['*'])
                              for i in result.get('langlinks')}
-
-            self.content = parseArticle(self.html)
-            if self.extlinks:
-                self.content.append([formats.h2, 'External links'])
-                self.content.append([0, '\n'.join(self.extlinks) + '\n'])
+            # Heading and index of the h2 sections, for editing them. The
+            # index is None for those from templates, which cannot be.
+            for i in result.get('sections', ()):
+                if i['level'] == '2':
+                    line = html.unescape(re.sub('<[^>]*>', '', i['line']))
+                    self.sections.append((line.strip(), i['index']
+                                          if i['index'].isdigit() else None))
+            if content is None:
+                content = articleContent(result)
+            self.content = content
+
+
+def _extlinks(result):
+    # if an url starts with //, it can by http or https.  Use http.
+    return ['http:' + i if i.startswith('//') else i
+            for i in result['externallinks']]
+
+
+def articleContent(result):
+    """Return the content of an article from the result of action=parse."""
+    with stats.timed('parse'):
+        content = parseArticle(result['text']['*'])
+    extlinks = _extlinks(result)
+    if extlinks:
+        content.extend([(formats.h2, 'External links'),
+                        (0, '\n'.join(extlinks) + '\n')])
+    return content
 
 
 class _Featured(_Page):
-    exists = True
-
-    def __init__(self, result):
-        self.title = result.find('title').text
-        self.content = []
-        self.content.append([0, parseFeature(result.find('description').text)])
-        for i in result.find_all('item'):
-            description = i.find('description').text
-            text = parseFeature(description)
-            self.content.append([formats.h2, i.find('title').text])
-            self.content.append([0, text])
-
-
+    __slots__ = ()
+
+    def __init__(self, feed):
+        # Descriptions are parsed when displayed
+        runs = [(0, feed['description'], parseFeature)]
+        for title, description in feed['items']:
+            runs.append((formats.h2, title, None))
+            runs.append((0, description, parseFeature))
+        super().__init__(feed['title'], True, LazyContent(runs))
+
+
+def _discover(url, via=None):
+    """Find the api url of the wiki a page url belongs to.
+
+    Return tuple (apiurl, general), where general is the general siteinfo
+    if known. The api is first looked for at the path it has on the wiki via
+    and the usual paths, with a siteinfo query. Failing that, the page is
+    downloaded for its EditURI link.
+    """
+    parts = urllib.parse.urlparse(url)
+    paths = ['/w/api.php', '/api.php']
+    if via and '://' in via.siteurl:
+        paths.insert(0, urllib.parse.urlparse(via.siteurl).path)
+    for path in dict.fromkeys(paths):
+        apiurl = parts.scheme + '://' + parts.netloc + path
+        try:
+            result = pool.request(apiurl + '?' + urllib.parse.urlencode(
+                {'action': 'query', 'meta': 'siteinfo', 'siprop': 'general',
+                 'format': 'json'})).body.decode('utf-8')
+            general = json.loads(result)['query']['general']
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
+        if urllib.parse.urlparse(general.get('server', '')).netloc == parts.netloc:
+            return apiurl, general
+    html = pool.request(url).body.decode()
+    soup = BeautifulSoup(html, 'lxml')
+    link = soup.find('link', rel='EditURI')
+    if not link:
+        return None, None
+    # The link is to the rsd document of api.php, given as ?action=rsd
+    rsdurl = urllib.parse.urljoin(url, link['href'])
+    return rsdurl.split('?', 1)[0], None
+
+
+def stop_prefetching():
+    """Cancel the queued background fetches of all wikis, without waiting."""
+    global _prefetcher
+    if _prefetcher is not None:
+        _prefetcher.shutdown(wait=False, cancel_futures=True)
+        _prefetcher = None
+
+
+_prefetcher = None
 cookiejar = http.cookiejar.CookieJar()
-opener = urllib.request.build_opener(
-    urllib.request.HTTPCookieProcessor(cookiejar))
-opener.addheaders = [('User-agent', useragent)]
-urllib.request.install_opener(opener)
+pool = ConnectionPool(cookiejar, {'User-agent': useragent}, settings.timeout)
+endpoints = EndpointCache(settings.configpath + '/endpoints.json')
@@ -0,0 +1,211 @@
+"""Conversion of wikitext to the html produced by MediaWiki.
+
+Only what parseArticle() uses is supported: headings, paragraphs, lists,
+preformatted text, bold and italics, and links. Templates, tables, files,
+categories and references are dropped, since they cannot be expanded
+without the wiki.
+"""
+import re
+import html
+
+_disambigtemplates = ('disambiguation', 'disambig', 'dab', 'hndis', 'geodis',
+                      'surname', 'given name')
+_dropnamespaces = ('file', 'image', 'category', 'media')
+_listtags = {'*': ('ul', 'li'), '#': ('ol', 'li'),
+             ';': ('dl', 'dt'), ':': ('dl', 'dd')}
+
+_comment = re.compile(r'<!--.*?(-->|$)', re.S)
+_ref = re.compile(r'<ref[^>/]*/>|<ref[^>]*>.*?</ref>', re.S | re.I)
+_nowiki = re.compile(r'<nowiki>(.*?)</nowiki>', re.S | re.I)
+_tag = re.compile(r'<(?!/?(b|i|u|s|em|strong|big|small|sub|sup|code|tt|span|'
+                  r'div|p|br|hr|blockquote|center|del|ins|strike|pre)\b)',
+                  re.I)
+_heading = re.compile(r'^(={1,6})\s*(.+?)\s*\1\s*$')
+_wikilink = re.compile(r'\[\[([^\[\]|]*)(?:\|([^\[\]]*))?\]\](\w*)')
+_extlink = re.compile(r'\[((?:https?:)?//[^\s\]]+)(?:\s+([^\]]*))?\]')
+_bolditalic = re.compile(r"'''''(.+?)('''''|$)")
+_bold = re.compile(r"'''(.+?)('''|$)")
+_italic = re.compile(r"''(.+?)(''|$)")
+
+
+def _blocks(text, start, end):
+    """Return text without the (nested) blocks between start and end.
+
+    Also returns the contents of the removed blocks.
+    """
+    out = []
+    removed = []
+    depth = 0
+    pos = 0
+    blockstart = None
+    pattern = re.compile(re.escape(start) + '|' + re.escape(end))
+    for match in pattern.finditer(text):
+        if match.group() == start:
+            if depth == 0:
+                out.append(text[pos:match.start()])
+                blockstart = match.end()
+            depth += 1
+        elif depth:
+            depth -= 1
+            if depth == 0:
+                removed.append(text[blockstart:match.start()])
+                pos = match.end()
+    if depth == 0:
+        out.append(text[pos:])
+    return ''.join(out), removed
+
+
+def _droplinks(text):
+    """Remove links to files, categories and other languages."""
+    out = []
+    pos = 0
+    depth = 0
+    for match in re.finditer(r'\[\[|\]\]', text):
+        if match.group() == '[[':
+            if depth == 0:
+                target = text[match.end():match.end() + 100]
+                prefix = target.split(':', 1)[0].strip().lower()
+                if ':' in target.split('|', 1)[0] and (
+                        prefix in _dropnamespaces or
+                        re.fullmatch('[a-z]{2,3}(-[a-z]+)?', prefix)):
+                    out.append(text[pos:match.start()])
+                    depth = 1
+                    continue
+            if depth:
+                depth += 1
+        elif depth:
+            depth -= 1
+            if depth == 0:
+                pos = match.end()
+    if not depth:
+        out.append(text[pos:])
+    return ''.join(out)
+
+
+class _Converter:
+
+    def __init__(self):
+        self.links = []
+        self.extlinks = []
+
+    def _link(self, match):
+        target, label, trail = match.groups()
+        target = target.strip()
+        title = target.split('#', 1)[0].lstrip(':').replace('_', ' ')
+        if label is None:
+            label = target.lstrip(':')
+        if title:
+            title = title[:1].upper() + title[1:]
+            self.links.append(title)
+        return '<a href="/wiki/%s">%s</a>' % (
+            html.escape(title.replace(' ', '_')), label + trail)
+
+    def _extlink(self, match):
+        url, label = match.groups()
+        self.extlinks.append(url)
+        if not label:
+            label = '[%d]' % len(self.extlinks)
+        return '<a class="external" href="%s">%s</a>' % (html.escape(url),
+                                                          label)
+
+    def inline(self, text):
+        text = _wikilink.sub(self._link, text)
+        text = _extlink.sub(self._extlink, text)
+        text = _bolditalic.sub(r'<b><i>\1</i></b>', text)
+        text = _bold.sub(r'<b>\1</b>', text)
+        text = _italic.sub(r'<i>\1</i>', text)
+        return text
+
+    def convert(self, text):
+        out = ['<div class="mw-parser-output">']
+        paragraph = []
+        openlists = ''
+        pre = []
+
+        def flush():
+            if paragraph:
+                out.append('<p>' + ' '.join(paragraph) + '</p>')
+                paragraph.clear()
+            if pre:
+                out.append('<pre>' + '\n'.join(pre) + '</pre>')
+                pre.clear()
+
+        def setlists(prefix):
+            nonlocal openlists
+            common = 0
+            while (common < min(len(prefix), len(openlists)) and
+                   _listtags[prefix[common]][0] ==
+                   _listtags[openlists[common]][0]):
+                common += 1
+            for i in reversed(openlists[common:]):
+                out.append('</%s></%s>' % (_listtags[i][1], _listtags[i][0]))
+            if common and common == len(prefix):
+                # A new item in the same list
+                out.append('</%s><%s>' % (_listtags[openlists[common - 1]][1],
+                                          _listtags[prefix[common - 1]][1]))
+            for i in prefix[common:]:
+                out.append('<%s><%s>' % _listtags[i])
+            openlists = prefix
+
+        for line in text.split('\n'):
+            heading = _heading.match(line)
+            listprefix = re.match('[*#:;]*', line).group()
+            if heading:
+                flush()
+                setlists('')
+                level = min(max(len(heading.group(1)), 2), 6)
+                out.append('<h%d><span class="mw-headline">%s</span></h%d>' %
+                           (level, self.inline(heading.group(2)), level))
+            elif listprefix:
+                flush()
+                setlists(listprefix)
+                out.append(self.inline(line[len(listprefix):].strip()))
+            elif line.startswith(' ') and line.strip():
+                if paragraph:
+                    flush()
+                setlists('')
+                pre.append(self.inline(line[1:]))
+            elif not line.strip():
+                flush()
+                setlists('')
+            else:
+                if pre:
+                    flush()
+                setlists('')
+                paragraph.append(self.inline(line.strip()))
+        flush()
+        setlists('')
+        out.append('</div>')
+        return '\n'.join(out)
+
+
+def toHtml(text):
+    """Convert wikitext to html.
+
+    Return tuple (html, links, externallinks, properties), where links are
+    the titles of the pages linked to and properties are the page properties
+    MediaWiki would report.
+    """
+    properties = []
+    nowikis = []
+
+    def nowiki(match):
+        nowikis.append(html.escape(match.group(1)))
+        return '\x00%d\x00' % (len(nowikis) - 1)
+
+    text = _nowiki.sub(nowiki, text)
+    text = _comment.sub('', text)
+    text = _ref.sub('', text)
+    text = _tag.sub('&lt;', text)
+    text, templates = _blocks(text, '{{', '}}')
+    names = [i.split('|', 1)[0].strip().lower() for i in templates]
+    if any(i in _disambigtemplates for i in names):
+        properties.append({'name': 'disambiguation', '*': ''})
+    text = _blocks(text, '{|', '|}')[0]
+    text = _droplinks(text)
+
+    converter = _Converter()
+    result = converter.convert(text)
+    result = re.sub('\x00(\\d+)\x00', lambda m: nowikis[int(m.group(1))],
+                    result)
+    return result, converter.links, converter.extlinks, properties